@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+#
+# Benchmark suite: times the EC, hashing, Base58 and wallet layers on their own
+# and end to end, and reports ops/sec and peak memory for each.  Every
+# benchmark runs in a fresh process so that its peak RSS is its own.  The
+# wallet benchmarks read a synthetic wallet.dat written by walletgen.py (or
+# a temporary copy of the --datadir one) and need bsddb; they are skipped
+# without it.
+#
+# Usage: python bench/run.py [--json=FILE] [--baseline=FILE] [--only=NAME,...]
+#
+# With --baseline, the exit status is 1 if any benchmark is more than
+# --tolerance slower than in the baseline JSON file.
+
+import os, sys
+import json
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import convertphrase
+
+# Each benchmark is set up by a function of the wallet directory that returns
+# (fn, ops): fn() is timed repeatedly, and each call counts as ops operations.
+
+def _secrets(count, seed=1):
+	rnd = random.Random(seed)
+	return [rnd.randrange(1, convertphrase._r) for i in xrange(count)]
+
+def _keys(count):
+	return convertphrase.derive_keys(_secrets(count))
+
+def bench_point_mul(db_dir):
+	point = _keys(1)[0].pubkey.point
+	secrets = _secrets(100, 2)
+	def fn():
+		for k in secrets:
+			point * k
+	return (fn, len(secrets))
+
+def bench_ec_key(db_dir):
+	secrets = _secrets(100)
+	def fn():
+		for secret in secrets:
+			convertphrase.EC_KEY(secret)
+	return (fn, len(secrets))
+
+def bench_sign(db_dir):
+	key = _keys(1)[0]
+	nonces = _secrets(100, 3)
+	def fn():
+		for k in nonces:
+			key.privkey.sign(0x1234567890abcdef, k)
+	return (fn, len(nonces))
+
+def bench_verify(db_dir):
+	key = _keys(1)[0]
+	signatures = [key.privkey.sign(0x1234567890abcdef, k) for k in _secrets(100, 3)]
+	def fn():
+		for signature in signatures:
+			key.pubkey.verifies(0x1234567890abcdef, signature)
+	return (fn, len(signatures))
+
+def bench_hash_160(db_dir):
+	public_keys = [convertphrase.GetPubKey(k) for k in _keys(1000)]
+	def fn():
+		for public_key in public_keys:
+			convertphrase.hash_160(public_key)
+	return (fn, len(public_keys))
+
+def bench_public_key_to_bc_address(db_dir):
+	public_keys = [convertphrase.GetPubKey(k) for k in _keys(1000)]
+	def fn():
+		for public_key in public_keys:
+			convertphrase.public_key_to_bc_address(public_key)
+	return (fn, len(public_keys))
+
+def _payloads():
+	return [chr(0) + convertphrase.hash_160(convertphrase.GetPubKey(k)) + 'chck' for k in _keys(1000)]
+
+def bench_b58encode(db_dir):
+	payloads = _payloads()
+	def fn():
+		for payload in payloads:
+			convertphrase.b58encode(payload)
+	return (fn, len(payloads))
+
+def bench_b58decode(db_dir):
+	encoded = [convertphrase.b58encode(payload) for payload in _payloads()]
+	def fn():
+		for s in encoded:
+			convertphrase.b58decode(s, 25)
+	return (fn, len(encoded))
+
+def bench_bcdatastream(db_dir):
+	import walletdb
+	# the fields of a pool record, 1000 times over
+	count = 1000
+	ds = walletdb.BCDataStream()
+	public_key = convertphrase.GetPubKey(_keys(1)[0])
+	for i in xrange(count):
+		ds.write_int64(i)
+		ds.write_int32(60000)
+		ds.write_int64(1300000000 + i)
+		ds.write_string(public_key)
+	data = ds.getvalue()
+	def fn():
+		ds = walletdb.BCDataStream()
+		ds.write(data)
+		for i in xrange(count):
+			ds.read_int64()
+			ds.read_int32()
+			ds.read_int64()
+			ds.read_string()
+	return (fn, count * 4)
+
+def _wallet_records(db_dir):
+	import walletdb
+	db_env = walletdb.create_env(db_dir)
+	db = walletdb.open_wallet(db_env)
+	count = sum(1 for record in walletdb.iter_db(db))
+	db.close()
+	return (walletdb, db_env, count)
+
+def bench_parse_wallet(db_dir):
+	(walletdb, db_env, count) = _wallet_records(db_dir)
+	def fn():
+		db = walletdb.open_wallet(db_env)
+		walletdb.parse_wallet(db, lambda type, d: d.get('__value__'))
+		db.close()
+	return (fn, count)
+
+def bench_read_wallet(db_dir):
+	(walletdb, db_env, count) = _wallet_records(db_dir)
+	devnull = open(os.devnull, 'w')
+	def fn():
+		stderr = sys.stderr
+		sys.stderr = devnull	# read_wallet prints the accounts
+		try:
+			walletdb.read_wallet({}, db_env, True, True, "")
+		finally:
+			sys.stderr = stderr
+	return (fn, count)
+
+def bench_rewrite_wallet(db_dir):
+	(walletdb, db_env, count) = _wallet_records(db_dir)
+	def fn():
+		walletdb.rewrite_wallet(db_env, 'rewrite.dat',
+			lambda type, d: type in walletdb.KEY_EXPORT_TYPES)
+		db_env.dbremove('rewrite.dat', flags=walletdb.DB_AUTO_COMMIT)
+	return (fn, count)
+
+BENCHMARKS = [
+	('point_mul', bench_point_mul),
+	('ec_key', bench_ec_key),
+	('sign', bench_sign),
+	('verify', bench_verify),
+	('hash_160', bench_hash_160),
+	('public_key_to_bc_address', bench_public_key_to_bc_address),
+	('b58encode', bench_b58encode),
+	('b58decode', bench_b58decode),
+	('bcdatastream_read', bench_bcdatastream),
+	('parse_wallet', bench_parse_wallet),
+	('read_wallet', bench_read_wallet),
+	('rewrite_wallet', bench_rewrite_wallet),
+]
+
+WALLET_BENCHMARKS = ('parse_wallet', 'read_wallet', 'rewrite_wallet')
+
+def run_one(name, db_dir, min_time):
+	"""Time one benchmark in this process; returns its result dictionary."""
+	(fn, ops) = dict(BENCHMARKS)[name](db_dir)
+	fn()	# warm up: caches, generator table
+	calls = 0
+	start = time.time()
+	while True:
+		fn()
+		calls += 1
+		seconds = time.time() - start
+		if seconds >= min_time:
+			break
+	return {
+		'name': name,
+		'ops': calls * ops,
+		'seconds': seconds,
+		'ops_per_sec': calls * ops / seconds,
+		'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+	}
+
+def run_isolated(name, db_dir, min_time):
+	output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+		'--child=%s' % name, '--datadir=%s' % db_dir, '--min-time=%f' % min_time])
+	return json.loads(output)
+
+def have_bsddb():
+	try:
+		import bsddb.db
+	except ImportError:
+		return False
+	return True
+
+def compare(results, baseline, tolerance):
+	"""The names of the benchmarks more than tolerance slower than baseline."""
+	before = dict((r['name'], r['ops_per_sec']) for r in baseline['results'])
+	return [r['name'] for r in results
+		if r['name'] in before and r['ops_per_sec'] < before[r['name']] * (1 - tolerance)]
+
+def main():
+	parser = OptionParser(usage="%prog [options]")
+	parser.add_option("--only", dest="only",
+		help="comma-separated names of the benchmarks to run")
+	parser.add_option("--min-time", dest="min_time", type="float", default=1.0,
+		help="seconds to run each benchmark for")
+	parser.add_option("--json", dest="json",
+		help="write the results to JSON (- for stdout)")
+	parser.add_option("--baseline", dest="baseline",
+		help="JSON results of an earlier run to compare against")
+	parser.add_option("--tolerance", dest="tolerance", type="float", default=0.2,
+		help="slowdown against the baseline counted as a regression (default 0.2)")
+	parser.add_option("--datadir", dest="datadir",
+		help="wallet directory whose wallet.dat the wallet benchmarks use; they run on a temporary copy (default: a synthetic wallet)")
+	parser.add_option("--child", dest="child", help="(internal) run one benchmark")
+	(options, args) = parser.parse_args()
+
+	if options.child:
+		print json.dumps(run_one(options.child, options.datadir, options.min_time))
+		return
+
+	names = [name for (name, setup) in BENCHMARKS]
+	if options.only:
+		names = [name for name in options.only.split(',') if name]
+		unknown = set(names) - set(dict(BENCHMARKS))
+		if unknown:
+			parser.error("unknown benchmarks: %s" % ', '.join(sorted(unknown)))
+
+	# the wallet benchmarks open an environment and write rewritten copies of
+	# the wallet, so they run in a private temporary directory: on a copy of
+	# the --datadir wallet.dat, or on a synthetic wallet
+	db_dir = tmp_dir = None
+	if [name for name in names if name in WALLET_BENCHMARKS]:
+		if not have_bsddb():
+			sys.stderr.write("bsddb not available, skipping the wallet benchmarks\n")
+			names = [name for name in names if name not in WALLET_BENCHMARKS]
+		else:
+			tmp_dir = db_dir = tempfile.mkdtemp(prefix='convertphrase-bench-')
+			if options.datadir:
+				shutil.copy(os.path.join(options.datadir, 'wallet.dat'), db_dir)
+			else:
+				import walletgen
+				walletgen.make_wallet(db_dir, **walletgen.DEFAULT_COUNTS)
+
+	out = sys.stderr if options.json == '-' else sys.stdout
+	results = []
+	try:
+		for name in names:
+			r = run_isolated(name, db_dir, options.min_time)
+			results.append(r)
+			out.write("%-28s %12.1f ops/s %10d KB peak\n" % (name, r['ops_per_sec'], r['peak_rss_kb']))
+	finally:
+		if tmp_dir is not None:
+			shutil.rmtree(tmp_dir)
+
+	report = {'python': sys.version.split()[0], 'time': time.time(), 'results': results}
+	if options.json == '-':
+		print json.dumps(report, sort_keys=True, indent=4)
+	elif options.json:
+		f = open(options.json, 'w')
+		json.dump(report, f, sort_keys=True, indent=4)
+		f.close()
+
+	if options.baseline:
+		slower = compare(results, json.load(open(options.baseline)), options.tolerance)
+		if slower:
+			out.write("slower than baseline: %s\n" % ', '.join(slower))
+			sys.exit(1)
+
+if __name__ == '__main__':
+	main()
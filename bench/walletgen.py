@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# Writes a synthetic wallet.dat for the benchmarks, with the given numbers of
+# key, name, pool, tx and acentry records (plus version and defaultkey).
+# The records are written with walletdb.update_wallet, except tx records,
+# whose value layout walletdb does not describe: they get a random blob.
+#
+# Usage: python bench/walletgen.py --datadir=DIR [--keys=N] [--names=N] ...
+
+import os, sys
+import random
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import convertphrase
+import walletdb
+
+DEFAULT_COUNTS = {'keys': 2000, 'names': 1000, 'pool': 1000, 'tx': 1000, 'acentry': 200}
+
+def make_wallet(db_dir, keys=2000, names=1000, pool=1000, tx=1000, acentry=200, seed=0,
+		commit_size=1000):
+	"""Create db_dir/wallet.dat (db_dir must exist and hold no wallet yet).
+	names label the first keys, pool entries reuse the key public keys.
+	Returns the number of records written.
+	"""
+	rnd = random.Random(seed)
+	db_env = walletdb.create_env(db_dir)
+	db = walletdb.open_wallet(db_env, writable=True)
+
+	secrets = [rnd.randrange(1, convertphrase._r) for i in xrange(max(keys, 1))]
+	ec_keys = convertphrase.derive_keys(secrets)
+	public_keys = [convertphrase.GetPubKey(k) for k in ec_keys]
+
+	def records():
+		yield ('version', {'version': 60000})
+		yield ('defaultkey', {'key': public_keys[0]})
+		for k in ec_keys[:keys]:
+			yield ('key', {'public_key': convertphrase.GetPubKey(k), 'private_key': convertphrase.GetPrivKey(k)})
+		for i in xrange(names):
+			addr = convertphrase.public_key_to_bc_address(public_keys[i % len(public_keys)])
+			yield ('name', {'hash': addr, 'name': 'label %d' % i})
+		for i in xrange(pool):
+			yield ('pool', {'n': i, 'nVersion': 60000, 'nTime': 1300000000 + i,
+				'public_key': public_keys[i % len(public_keys)]})
+		for i in xrange(tx):
+			tx_id = ''.join(chr(rnd.getrandbits(8)) for j in xrange(32))
+			blob = ''.join(chr(rnd.getrandbits(8)) for j in xrange(rnd.randint(200, 600)))
+			yield ('tx', (tx_id, blob))
+		for i in xrange(acentry):
+			yield ('acentry', {'account': 'account %d' % (i % 10), 'n': i, 'nVersion': 60000,
+				'nCreditDebit': rnd.randint(-10**8, 10**8), 'nTime': 1300000000 + i,
+				'otherAccount': 'account %d' % ((i + 1) % 10), 'comment': 'move %d' % i})
+
+	written = 0
+	txn = None
+	for (type, data) in records():
+		if txn is None:
+			txn = db_env.txn_begin()
+		if type == 'tx':
+			kds = walletdb.BCDataStream()
+			kds.write_string('tx')
+			kds.write(data[0])
+			db.put(kds.getvalue(), data[1], txn=txn)
+		else:
+			walletdb.update_wallet(db, type, data, txn=txn)
+		written += 1
+		if written % commit_size == 0:
+			txn.commit()
+			txn = None
+	if txn is not None:
+		txn.commit()
+
+	db.close()
+	db_env.close()
+	return written
+
+def main():
+	parser = OptionParser(usage="%prog [options]")
+	parser.add_option("--datadir", dest="datadir",
+		help="directory to create wallet.dat in")
+	for (name, count) in sorted(DEFAULT_COUNTS.items()):
+		parser.add_option("--%s" % name, dest=name, type="int", default=count,
+			help="number of %s records (default %d)" % (name, count))
+	parser.add_option("--seed", dest="seed", type="int", default=0,
+		help="random seed")
+	(options, args) = parser.parse_args()
+
+	if not options.datadir:
+		parser.error("--datadir is required")
+	if not os.path.isdir(options.datadir):
+		os.makedirs(options.datadir)
+	counts = dict((name, getattr(options, name)) for name in DEFAULT_COUNTS)
+	written = make_wallet(options.datadir, seed=options.seed, **counts)
+	print "%d records written to %s" % (written, os.path.join(options.datadir, 'wallet.dat'))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,304 @@
+# Server mode for convertphrase.py (--daemon=SOCKET): one long-running process
+# that keeps the generator tables, the open wallet and its DBEnv warm, and
+# answers requests from local clients over a Unix socket.
+#
+# Protocol: each message, in either direction, is a frame made of a 4-byte
+# big-endian length followed by that many bytes of JSON.  A request is
+# {"id": ..., "op": ..., <arguments>}; the response carries the same id and
+# either "result" or "error".  Clients may pipeline: requests on one
+# connection are answered in order, and each connection has its own thread.
+# Byte strings (public keys, hashes, signature values) are hex-encoded.
+#
+#   derive   phrase | sec            -> {address, sec, public_key}
+#   encode   public_key | hash160    -> {address, hash160}
+#   sign     sec, hash               -> {r, s}
+#   verify   public_key, hash, r, s  -> {valid}
+#   wallet   address | public_key | hash160 [, reload]
+#                                    -> {addr, sec, label} or null
+
+import os, sys
+import collections
+import hashlib
+import json
+import signal
+import socket
+import stat
+import struct
+import threading
+import SocketServer
+
+import convertphrase
+
+_frame_header = struct.Struct('>I')
+MAX_FRAME_SIZE = 1 << 20
+
+class ProtocolError(Exception): pass
+
+def read_frame(f):
+	"""The next message from the file object f, None at end of stream.
+	Raises ProtocolError if the stream is broken, ValueError if the frame
+	is not JSON (the stream is still in step then).
+	"""
+	header = f.read(_frame_header.size)
+	if not header:
+		return None
+	if len(header) < _frame_header.size:
+		raise ProtocolError("truncated frame header")
+	(length,) = _frame_header.unpack(header)
+	if length > MAX_FRAME_SIZE:
+		raise ProtocolError("frame of %d bytes is too large" % length)
+	data = f.read(length)
+	if len(data) < length:
+		raise ProtocolError("truncated frame")
+	return json.loads(data)
+
+def write_frame(f, message):
+	data = json.dumps(message, separators=(',', ':'))
+	f.write(_frame_header.pack(len(data)) + data)
+	f.flush()
+
+def _bytes_arg(request, name):
+	try:
+		return request[name].decode('hex_codec')
+	except KeyError:
+		raise ValueError("missing argument: %s" % name)
+	except (TypeError, AttributeError):
+		raise ValueError("%s is not hex" % name)
+
+def _long_arg(request, name):
+	return convertphrase.str_to_long(_bytes_arg(request, name))
+
+def _key_arg(request):
+	if 'phrase' in request:
+		sec = convertphrase.SecretToASecret(hashlib.sha256(request['phrase'].encode('utf-8')).digest())
+	elif 'sec' in request:
+		sec = str(request['sec'])
+	else:
+		raise ValueError("missing argument: phrase or sec")
+	key = convertphrase.regenerate_key(sec)
+	if not key:
+		raise ValueError("invalid private key")
+	return (key, sec)
+
+class Handlers(object):
+	"""The operations, on warm state shared by all connections."""
+
+	# decoded public keys kept for verify, with the tables their points cache
+	PUBLIC_KEY_CACHE_SIZE = 4096
+
+	def __init__(self, datadir, nodbenv=False):
+		self.datadir = datadir
+		self.nodbenv = nodbenv
+		self.db_env = None
+		self.wallet = None
+		self.lock = threading.Lock()
+		self.public_keys = collections.OrderedDict()	# bytes -> Public_key, least recently used first
+		self.public_keys_lock = threading.Lock()
+
+	def warm_up(self):
+		convertphrase._warm_generator()
+		if os.path.exists(os.path.join(self.datadir, 'wallet.dat')):
+			# a wallet that cannot be read is reported, not fatal: wallet
+			# requests try again, and fail with the error
+			try:
+				self.get_wallet()
+			except Exception, e:
+				sys.stderr.write("wallet not loaded: %s\n" % e)
+
+	def get_wallet(self, reload=False):
+		"""The loaded Wallet, loaded first if need be (or if reload is set).
+		Concurrent first requests wait for a single load. Raises ValueError
+		if the wallet cannot be opened or read; a wallet loaded before is
+		kept then.
+		"""
+		with self.lock:
+			if reload or self.wallet is None:
+				if not os.path.exists(os.path.join(self.datadir, 'wallet.dat')):
+					raise ValueError("no wallet.dat in %s" % self.datadir)
+				import walletdb
+				db = None
+				try:
+					# walletdb exits the process when it cannot open the
+					# wallet (locked by bitcoind, say) or parse a record
+					try:
+						if self.nodbenv:
+							db = walletdb.open_wallet_file(self.datadir)
+						else:
+							if self.db_env is None:
+								self.db_env = walletdb.create_env(self.datadir)
+							db = walletdb.open_wallet(self.db_env)
+						self.wallet = walletdb.load_wallet(self.db_env, walletdb.KEY_EXPORT_TYPES, db=db)
+					except SystemExit:
+						raise ValueError("cannot read wallet.dat in %s" % self.datadir)
+					except walletdb.SerializationError, e:
+						raise ValueError("cannot read wallet.dat in %s: %s" % (self.datadir, e))
+				finally:
+					if db is not None:
+						db.close()
+			return self.wallet
+
+	def public_key(self, data):
+		"""The Public_key of the serialized public key data, decoded once and
+		then reused, so repeated keys keep their multiplication tables.
+		"""
+		with self.public_keys_lock:
+			public_key = self.public_keys.pop(data, None)
+			if public_key is not None:
+				self.public_keys[data] = public_key
+				return public_key
+		public_key = convertphrase.o2i_ECPublicKey(data)
+		if public_key is None:
+			raise ValueError("invalid public key")
+		with self.public_keys_lock:
+			self.public_keys[data] = public_key
+			if len(self.public_keys) > self.PUBLIC_KEY_CACHE_SIZE:
+				self.public_keys.popitem(last=False)
+		return public_key
+
+	def close(self):
+		if self.db_env is not None:
+			self.db_env.close()
+			self.db_env = None
+
+	def op_derive(self, request):
+		(key, sec) = _key_arg(request)
+		public_key = convertphrase.GetPubKey(key)
+		return {'address': convertphrase.public_key_to_bc_address(public_key), 'sec': sec,
+			'public_key': public_key.encode('hex_codec')}
+
+	def op_encode(self, request):
+		if 'public_key' in request:
+			h160 = convertphrase.hash_160(_bytes_arg(request, 'public_key'))
+		else:
+			h160 = _bytes_arg(request, 'hash160')
+		return {'address': convertphrase.hash_160_to_bc_address(h160), 'hash160': h160.encode('hex_codec')}
+
+	def op_sign(self, request):
+		(key, sec) = _key_arg(request)
+		n = convertphrase._r
+		k = convertphrase.str_to_long(os.urandom(32)) % (n - 1) + 1
+		signature = key.privkey.sign(_long_arg(request, 'hash'), k)
+		return {'r': '%064x' % signature.r, 's': '%064x' % signature.s}
+
+	def op_verify(self, request):
+		public_key = self.public_key(_bytes_arg(request, 'public_key'))
+		signature = convertphrase.Signature(_long_arg(request, 'r'), _long_arg(request, 's'))
+		return {'valid': public_key.verifies(_long_arg(request, 'hash'), signature)}
+
+	def op_wallet(self, request):
+		wallet = self.get_wallet(request.get('reload'))
+		if 'address' in request:
+			k = wallet.key_by_address(str(request['address']))
+		elif 'public_key' in request:
+			k = wallet.key_by_public_key(_bytes_arg(request, 'public_key'))
+		else:
+			k = wallet.key_by_hash160(_bytes_arg(request, 'hash160'))
+		if k is None:
+			return None
+		return {'addr': k['addr'], 'sec': k['sec'], 'label': wallet.label(k['addr'])}
+
+	def handle(self, request):
+		"""The response to one request."""
+		response = {'id': request.get('id')}
+		op = getattr(self, 'op_%s' % request.get('op'), None)
+		if op is None:
+			response['error'] = "unknown op: %s" % request.get('op')
+			return response
+		try:
+			response['result'] = op(request)
+		except Exception, e:
+			response['error'] = str(e) or e.__class__.__name__
+		return response
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+	def handle(self):
+		while True:
+			try:
+				request = read_frame(self.rfile)
+			except ProtocolError, e:
+				# the stream is out of step; report and drop the connection
+				write_frame(self.wfile, {'id': None, 'error': str(e)})
+				return
+			except ValueError, e:
+				write_frame(self.wfile, {'id': None, 'error': "bad JSON: %s" % e})
+				continue
+			if request is None:
+				return
+			if not isinstance(request, dict):
+				write_frame(self.wfile, {'id': None, 'error': "request is not an object"})
+				continue
+			write_frame(self.wfile, self.server.handlers.handle(request))
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+	def __init__(self, path, handlers):
+		# a stale socket left by a previous server is replaced, anything else
+		# at path is not
+		if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+			os.unlink(path)
+		self.path = path
+		self.handlers = handlers
+		umask = os.umask(0077)	# sign takes secrets: owner only
+		try:
+			SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+		finally:
+			os.umask(umask)
+
+	def server_close(self):
+		SocketServer.UnixStreamServer.server_close(self)
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+
+def serve(path, datadir, nodbenv=False):
+	"""Warm up and serve on the Unix socket path until interrupted or
+	terminated.
+	"""
+	handlers = Handlers(datadir, nodbenv)
+	handlers.warm_up()
+	server = Server(path, handlers)
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	sys.stderr.write("listening on %s\n" % path)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		handlers.close()
+
+class Client(object):
+	"""A connection to the daemon. call() sends one request and waits for its
+	result; send() and receive() pipeline several.
+	"""
+	def __init__(self, path):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.connect(path)
+		self.rfile = self.sock.makefile('rb')
+		self.wfile = self.sock.makefile('wb')
+		self.next_id = 0
+
+	def send(self, op, **args):
+		self.next_id += 1
+		args['op'] = op
+		args['id'] = self.next_id
+		write_frame(self.wfile, args)
+		return self.next_id
+
+	def receive(self):
+		response = read_frame(self.rfile)
+		if response is None:
+			raise ProtocolError("connection closed")
+		return response
+
+	def call(self, op, **args):
+		self.send(op, **args)
+		response = self.receive()
+		if 'error' in response:
+			raise RuntimeError(response['error'])
+		return response['result']
+
+	def close(self):
+		self.rfile.close()
+		self.wfile.close()
+		self.sock.close()
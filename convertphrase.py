@@ -10,25 +10,29 @@
 #   --version              show program's version number and exit
 #   -h, --help             show this help message and exit
 #   --phrase="KEYSTR"  convert the passphrase "KEYSTR" to a private key hash
-
-from bsddb.db import *
-import os, sys, time
-import json
-import logging
-import struct
-import StringIO
-import traceback
-import socket
-import types
-import string
-import exceptions
+#   --datadir=DATADIR      wallet directory (defaults to bitcoin default)
+#   --dumpwallet           dump the wallet in DATADIR as JSON
+#   --exportwallet         write the wallet records as NDJSON, as they are read
+#   --nodbenv              read wallet.dat directly, without a DB environment
+#   --workers=WORKERS      derive keys for --dumpwallet in WORKERS processes
+#   --chunksize=CHUNKSIZE  records per work unit with --workers
+#   --importprivkeys=KEYFILE
+#                          import the WIF private keys listed in KEYFILE
+#   --commitsize=COMMITSIZE
+#                          write at most COMMITSIZE records per transaction
+#   --nosync               only flush the last import transaction to disk
+#   --stats                print operation counts and stage times to stderr (not with --daemon)
+#   --daemon=SOCKET        serve requests on a Unix socket (see convertd.py)
+
+# The wallet.dat code lives in walletdb.py and is only imported by the wallet
+# options, so that --phrase does not load bsddb and the modules it needs.
+
+import os, sys
 import hashlib
-import random
+import struct
 
 max_version = 32400
 addrtype = 0
-json_db = {}
-private_keys = []
 
 def determine_db_dir():
 	import os
@@ -49,7 +53,14 @@ _a = 0x0000000000000000000000000000000000000000000000000000000000000000L
 _Gx = 0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798L
 _Gy = 0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8L
 
+# The point and key classes below use __slots__: wallet analysis holds
+# hundreds of thousands of derived keys, and a per-instance __dict__ would
+# more than double their size.  They are not modified after construction
+# (Point only fills in its cached table of odd multiples).
+
 class CurveFp( object ):
+	__slots__ = ( '__p', '__a', '__b' )
+
 	def __init__( self, p, a, b ):
 		self.__p = p
 		self.__a = a
@@ -68,13 +79,20 @@ class CurveFp( object ):
 		return ( y * y - ( x * x * x + self.__a * x + self.__b ) ) % self.__p == 0
 
 class Point( object ):
-	def __init__( self, curve, x, y, order = None ):
+	__slots__ = ( '__curve', '__x', '__y', '__order', '__odd_multiples' )
+
+	def __init__( self, curve, x, y, order = None, validate = True ):
+		"""Points computed internally from valid points are trusted and built
+		with validate = False; anything coming from outside is checked here.
+		"""
 		self.__curve = curve
 		self.__x = x
 		self.__y = y
 		self.__order = order
-		if self.__curve: assert self.__curve.contains_point( x, y )
-		if order: assert self * order == INFINITY
+		self.__odd_multiples = None
+		if validate:
+			if self.__curve: assert self.__curve.contains_point( x, y )
+			if order: assert self * order == INFINITY
  
 	def __add__( self, other ):
 		if other == INFINITY: return self
@@ -91,30 +109,26 @@ class Point( object ):
 					inverse_mod( other.__x - self.__x, p ) ) % p
 		x3 = ( l * l - self.__x - other.__x ) % p
 		y3 = ( l * ( self.__x - x3 ) - self.__y ) % p
-		return Point( self.__curve, x3, y3 )
+		return Point( self.__curve, x3, y3, validate = False )
 
 	def __mul__( self, other ):
-		def leftmost_bit( x ):
-			assert x > 0
-			result = 1L
-			while result <= x: result = 2 * result
-			return result / 2
-
 		e = other
 		if self.__order: e = e % self.__order
 		if e == 0: return INFINITY
 		if self == INFINITY: return INFINITY
+		if _is_generator( self ):
+			return _jacobian_to_point( self.__curve, _generator_multiply( e ) )
 		assert e > 0
-		e3 = 3 * e
-		negative_self = Point( self.__curve, self.__x, -self.__y, self.__order )
-		i = leftmost_bit( e3 ) / 2
-		result = self
-		while i > 1:
-			result = result.double()
-			if ( e3 & i ) != 0 and ( e & i ) == 0: result = result + self
-			if ( e3 & i ) == 0 and ( e & i ) != 0: result = result + negative_self
-			i = i / 2
-		return result
+		return _jacobian_to_point( self.__curve, _multiply_sum( self.__curve, [ ( e, self ) ] ) )
+
+	def _odd_multiples( self ):
+		"""The affine points P, 3P, ..., ( 2^(w-1) - 1 )P used by the wNAF
+		multiplier, computed on first use and kept with the point.
+		"""
+		if self.__odd_multiples is None:
+			self.__odd_multiples = _odd_multiples( self.__x, self.__y, _WNAF_WIDTH,
+				self.__curve.p(), self.__curve.a() )
+		return self.__odd_multiples
 
 	def __rmul__( self, other ):
 		return self * other
@@ -133,7 +147,7 @@ class Point( object ):
 					inverse_mod( 2 * self.__y, p ) ) % p
 		x3 = ( l * l - 2 * self.__x ) % p
 		y3 = ( l * ( self.__x - x3 ) - self.__y ) % p
-		return Point( self.__curve, x3, y3 )
+		return Point( self.__curve, x3, y3, validate = False )
 
 	def x( self ):
 		return self.__x
@@ -160,21 +174,486 @@ def inverse_mod( a, m ):
 	if ud > 0: return ud
 	else: return ud + m
 
+# Jacobian coordinates: ( X, Y, Z ) stands for the affine point
+# ( X / Z^2, Y / Z^3 ), Z == 0 for the point at infinity.  Additions and
+# doublings need no inversion; only the final conversion back to affine does.
+
+_JACOBIAN_INFINITY = ( 1, 1, 0 )
+
+def _jacobian_double( P, p, a ):
+	X1, Y1, Z1 = P
+	if Y1 == 0 or Z1 == 0: return _JACOBIAN_INFINITY
+	YY = Y1 * Y1 % p
+	S = 4 * X1 * YY % p
+	if a == 0:
+		M = 3 * X1 * X1 % p
+	else:
+		ZZ = Z1 * Z1 % p
+		M = ( 3 * X1 * X1 + a * ZZ * ZZ ) % p
+	X3 = ( M * M - 2 * S ) % p
+	Y3 = ( M * ( S - X3 ) - 8 * YY * YY ) % p
+	Z3 = 2 * Y1 * Z1 % p
+	return ( X3, Y3, Z3 )
+
+def _jacobian_add( P, Q, p, a ):
+	X1, Y1, Z1 = P
+	X2, Y2, Z2 = Q
+	if Z1 == 0: return Q
+	if Z2 == 0: return P
+	Z1Z1 = Z1 * Z1 % p
+	if Z2 == 1:
+		# mixed addition, Q is affine
+		U1, S1 = X1, Y1
+	else:
+		Z2Z2 = Z2 * Z2 % p
+		U1 = X1 * Z2Z2 % p
+		S1 = Y1 * Z2 * Z2Z2 % p
+	U2 = X2 * Z1Z1 % p
+	S2 = Y2 * Z1 * Z1Z1 % p
+	H = ( U2 - U1 ) % p
+	R = ( S2 - S1 ) % p
+	if H == 0:
+		if R == 0: return _jacobian_double( P, p, a )
+		return _JACOBIAN_INFINITY
+	HH = H * H % p
+	HHH = H * HH % p
+	V = U1 * HH % p
+	X3 = ( R * R - HHH - 2 * V ) % p
+	Y3 = ( R * ( V - X3 ) - S1 * HHH ) % p
+	Z3 = Z1 * Z2 * H % p
+	return ( X3, Y3, Z3 )
+
+def _jacobian_to_affine( P, p ):
+	X, Y, Z = P
+	if Z == 0: return None
+	zi = inverse_mod( Z, p )
+	zi2 = zi * zi % p
+	return ( X * zi2 % p, Y * zi2 * zi % p )
+
+def _jacobian_to_point( curve, P ):
+	xy = _jacobian_to_affine( P, curve.p() )
+	if xy is None: return INFINITY
+	return Point( curve, xy[0], xy[1], validate = False )
+
+def _batch_inverse_mod( values, m ):
+	"""Inverses of a list of non-zero values mod m with a single inverse_mod
+	(Montgomery's trick).
+	"""
+	prefix = []
+	acc = 1
+	for v in values:
+		prefix.append( acc )
+		acc = acc * v % m
+	inv = inverse_mod( acc, m )
+	result = [ None ] * len( values )
+	for i in xrange( len( values ) - 1, -1, -1 ):
+		result[i] = inv * prefix[i] % m
+		inv = inv * values[i] % m
+	return result
+
+def _batch_to_affine( points, p ):
+	"""Convert a list of Jacobian points to affine ( x, y ) tuples (None for
+	infinity) with a single inversion.
+	"""
+	inverses = iter( _batch_inverse_mod( [ Z for X, Y, Z in points if Z != 0 ], p ) )
+	result = []
+	for X, Y, Z in points:
+		if Z == 0:
+			result.append( None )
+			continue
+		zi = inverses.next()
+		zi2 = zi * zi % p
+		result.append( ( X * zi2 % p, Y * zi2 * zi % p ) )
+	return result
+
+# width-w NAF multiplication: the scalar is recoded into odd digits in
+# ( -2^(w-1), 2^(w-1) ) with at least w-1 zeros after each non-zero digit,
+# so there is one addition per w+1 bits on average, from a table of odd
+# multiples of the point.
+
+_WNAF_WIDTH = 5
+
+def _wnaf( k, w ):
+	"""Width-w NAF digits of k >= 0, least significant first."""
+	digits = []
+	window = 1 << w
+	half = window >> 1
+	while k:
+		if k & 1:
+			d = k & ( window - 1 )
+			if d >= half: d -= window
+			k -= d
+		else:
+			d = 0
+		digits.append( d )
+		k >>= 1
+	return digits
+
+def _signed_wnaf( k, w ):
+	if k < 0: return [ -d for d in _wnaf( -k, w ) ]
+	return _wnaf( k, w )
+
+def _odd_multiples( x, y, w, p, a ):
+	P = ( x, y, 1 )
+	P2 = _jacobian_double( P, p, a )
+	points = [ P ]
+	for i in xrange( ( 1 << ( w - 2 ) ) - 1 ):
+		points.append( _jacobian_add( points[-1], P2, p, a ) )
+	return _batch_to_affine( points, p )
+
+def _multi_multiply( terms, p, a ):
+	"""Straus interleaving: the sum of k_i * P_i as a Jacobian point, where
+	terms holds ( odd multiples of P_i, wNAF digits of k_i ) pairs. All the
+	terms share a single doubling chain.
+	"""
+	if not terms: return _JACOBIAN_INFINITY
+	tables = [ table for table, digits in terms ]
+	length = max( len( digits ) for table, digits in terms )
+	columns = zip( *[ digits + [ 0 ] * ( length - len( digits ) ) for table, digits in terms ] )
+	result = _JACOBIAN_INFINITY
+	for column in reversed( columns ):
+		result = _jacobian_double( result, p, a )
+		for table, d in zip( tables, column ):
+			if d > 0:
+				Q = table[d >> 1]
+				if Q is not None: result = _jacobian_add( result, ( Q[0], Q[1], 1 ), p, a )
+			elif d < 0:
+				Q = table[-d >> 1]
+				if Q is not None: result = _jacobian_add( result, ( Q[0], p - Q[1], 1 ), p, a )
+	return result
+
+def _multiply_sum( curve, pairs ):
+	"""u1 * P1 + u2 * P2 + ... for ( u, P ) pairs with u >= 0, as a Jacobian
+	point. The secp256k1 generator uses its wide precomputed table, and on
+	secp256k1 every scalar is split with the GLV endomorphism, which reduces
+	it mod n: the points must be on the curve (see Public_key).
+	"""
+	glv = _is_secp256k1( curve )
+	terms = []
+	for u, P in pairs:
+		if _is_generator( P ):
+			table, w = _generator_odd_multiples(), _G_WNAF_WIDTH
+		elif P != INFINITY:
+			table, w = P._odd_multiples(), _WNAF_WIDTH
+		else:
+			continue
+		if glv:
+			k1, k2 = _glv_split( u % _r )
+			if _is_generator( P ):
+				endo_table = _generator_endomorphism_table()
+			else:
+				endo_table = _endomorphism( table )
+			terms.append( ( table, _signed_wnaf( k1, w ) ) )
+			terms.append( ( endo_table, _signed_wnaf( k2, w ) ) )
+		else:
+			terms.append( ( table, _wnaf( u, w ) ) )
+	return _multi_multiply( terms, curve.p(), curve.a() )
+
+def _jacobian_x_mod_n_equals( P, r, p, n ):
+	"""Check ( X / Z^2 mod p ) mod n == r without converting to affine."""
+	X, Y, Z = P
+	if Z == 0: return False
+	zz = Z * Z % p
+	x = r
+	while x < p:
+		if X == x * zz % p: return True
+		x += n
+	return False
+
+# GLV endomorphism of secp256k1: lambda * ( x, y ) = ( beta * x, y ) for
+# every point, so k splits into k1 + k2 * lambda (mod n) with |k1| and |k2|
+# around 2^128, and k * P = k1 * P + k2 * lambda(P) takes half the doublings.
+
+_beta = 0x7AE96A2B657C07106E64479EAC3434E99CF0497512F58995C1396C28719501EEL
+_lambda = 0x5363AD4CC05C30E0A5261C028812645A122E22EA20816678DF02967C1B23BD72L
+_glv_a1 = 0x3086D221A7D46BCDE86C90E49284EB15L
+_glv_b1 = -0xE4437ED6010E88286F547FA90ABFE4C3L
+_glv_a2 = 0x114CA50F7A8E2F3F657C1108D9D44CFD8L
+_glv_b2 = _glv_a1
+
+def _is_secp256k1( curve ):
+	return curve is not None and curve.p() == _p and curve.a() == _a and curve.b() == _b
+
+def _glv_split( k ):
+	"""k1, k2 with k1 + k2 * lambda == k (mod n), for 0 <= k < n."""
+	c1 = ( _glv_b2 * k + _r / 2 ) / _r
+	c2 = ( -_glv_b1 * k + _r / 2 ) / _r
+	k1 = k - c1 * _glv_a1 - c2 * _glv_a2
+	k2 = -c1 * _glv_b1 - c2 * _glv_b2
+	return k1, k2
+
+def _endomorphism( table ):
+	return [ Q and ( _beta * Q[0] % _p, Q[1] ) for Q in table ]
+
+# fixed-base multiplication by the secp256k1 generator: row i of the table
+# holds the affine points j * 16^i * G for j = 1..15, so k * G is one mixed
+# addition per non-zero nibble of k and no doublings at all.  It is only
+# used when the cached wide table below is not available.  Building it costs
+# about as much as 16 multiplications without it, so the first
+# _G_TABLE_THRESHOLD multiplications in a process use the GLV path instead.
+
+_G_WINDOW = 4
+_G_TABLE_THRESHOLD = 16
+
+# in a shared doubling chain ( Public_key.verifies ) the generator is instead
+# used through a wide table of its odd multiples: 2^(8-2) points, about one
+# addition per 9 bits.
+
+_G_WNAF_WIDTH = 8
+
+curve_secp256k1 = CurveFp( _p, _a, _b )
+generator_secp256k1 = Point( curve_secp256k1, _Gx, _Gy, _r )
+
+_generator_table_rows = None
+_generator_multiplications = 0
+_generator_odd_multiples_table = None
+_generator_endomorphism_odd_multiples = None
+
+def _is_generator( point ):
+	return point.x() == _Gx and point.y() == _Gy and _is_secp256k1( point.curve() )
+
+def _generator_comb( window ):
+	"""The affine comb points j * 2^(window*i) * G, for 1 <= j < 2^window,
+	row i by row.
+	"""
+	size = ( 1 << window ) - 1
+	points = []
+	base = ( _Gx, _Gy, 1 )
+	for i in xrange( ( _r.bit_length() + window - 1 ) / window ):
+		P = base
+		points.append( P )
+		for j in xrange( 1, size ):
+			P = _jacobian_add( P, base, _p, _a )
+			points.append( P )
+		base = _jacobian_add( P, base, _p, _a )
+	return _batch_to_affine( points, _p )
+
+def _generator_table():
+	global _generator_table_rows
+	if _generator_table_rows is None:
+		size = ( 1 << _G_WINDOW ) - 1
+		affine = _generator_comb( _G_WINDOW )
+		_generator_table_rows = [ affine[i:i+size] for i in xrange( 0, len( affine ), size ) ]
+	return _generator_table_rows
+
+def _generator_odd_multiples():
+	global _generator_odd_multiples_table
+	if _generator_odd_multiples_table is None:
+		_generator_odd_multiples_table = _odd_multiples( _Gx, _Gy, _G_WNAF_WIDTH, _p, _a )
+	return _generator_odd_multiples_table
+
+def _generator_endomorphism_table():
+	global _generator_endomorphism_odd_multiples
+	if _generator_endomorphism_odd_multiples is None:
+		_generator_endomorphism_odd_multiples = _endomorphism( _generator_odd_multiples() )
+	return _generator_endomorphism_odd_multiples
+
+# A wider comb, 8 bits per row ( 32 rows of 255 points, 32 additions per
+# multiplication ), is kept on disk in the cache directory: built once,
+# memory-mapped by later processes and decoded a point at a time as the
+# multiplications touch it, so short runs get it without building it.
+# The points depend on nothing but the curve, so the SHA-256 of the whole
+# table is pinned below and checked when the file is opened: a wrong point
+# would mean wrong keys and addresses.  The file is rebuilt when missing,
+# damaged or written for other parameters; when the cache directory is not
+# writable, the in-memory table above is used instead.
+#
+# File layout: the header below, zero padding up to _G_CACHE_HEADER_SIZE,
+# then the points as 32-byte big-endian x and y, row by row.
+
+_G_CACHE_WINDOW = 8
+_G_CACHE_VERSION = 2
+_G_CACHE_MAGIC = 'CPGT'
+_G_CACHE_HEADER_SIZE = 64
+_G_CACHE_FILENAME = 'generator-%d.table' % _G_CACHE_WINDOW
+# magic, version, window, rows, parameters digest
+_G_CACHE_HEADER = struct.Struct( '>4sIII32s' )
+# SHA-256 of the points
+_G_CACHE_DIGEST = '063ba44b38195e8af0d2eb0e2c570d9939e4df16633c19b7c03e54d40eea92dd'
+
+_generator_cache = None		# the _GeneratorTableFile, False if unavailable
+
+def determine_cache_dir():
+	"""Where the generator table is cached; None (no caching) if the
+	CONVERTPHRASE_CACHE_DIR environment variable is set but empty.
+	"""
+	if 'CONVERTPHRASE_CACHE_DIR' in os.environ:
+		return os.environ['CONVERTPHRASE_CACHE_DIR'] or None
+	if sys.platform == 'darwin':
+		return os.path.expanduser("~/Library/Caches/convertphrase")
+	elif sys.platform == 'win32':
+		return os.path.join(os.environ.get('LOCALAPPDATA', os.environ['APPDATA']), "convertphrase")
+	return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser("~/.cache")), "convertphrase")
+
+class _GeneratorTableFile( object ):
+	"""The wide generator table, read from a mapped cache file."""
+	__slots__ = ( 'file', 'map', 'points' )
+
+	rows = ( _r.bit_length() + _G_CACHE_WINDOW - 1 ) / _G_CACHE_WINDOW
+	size = ( 1 << _G_CACHE_WINDOW ) - 1
+	length = _G_CACHE_HEADER_SIZE + rows * size * 64
+
+	@staticmethod
+	def parameters():
+		# what the table depends on; a file built for anything else is stale
+		return hashlib.sha256( '%x %x %x %x %x %d' % ( _p, _b, _Gx, _Gy, _r, _G_CACHE_WINDOW ) ).digest()
+
+	@classmethod
+	def open( cls, path ):
+		"""The table in path, or None if it is missing, stale or damaged."""
+		import mmap
+		try:
+			f = open( path, 'rb' )
+		except IOError:
+			return None
+		m = None
+		try:
+			m = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+			if len( m ) == cls.length and \
+					_G_CACHE_HEADER.unpack_from( m ) == ( _G_CACHE_MAGIC, _G_CACHE_VERSION, _G_CACHE_WINDOW,
+						cls.rows, cls.parameters() ) and \
+					hashlib.sha256( buffer( m, _G_CACHE_HEADER_SIZE ) ).hexdigest() == _G_CACHE_DIGEST:
+				return cls( f, m )
+		except ( mmap.error, ValueError ):
+			pass
+		if m is not None:
+			m.close()
+		f.close()
+		return None
+
+	@classmethod
+	def write( cls, path ):
+		"""Build the table and write it to path, atomically. Returns False,
+		without building anything, if path cannot be written.
+		"""
+		import tempfile
+		directory = os.path.dirname( path )
+		try:
+			if not os.path.isdir( directory ):
+				os.makedirs( directory )
+			fd, temp_path = tempfile.mkstemp( dir = directory )
+		except ( IOError, OSError ):
+			return False
+		try:
+			body = ''.join( ( '%064x%064x' % xy ).decode( 'hex' ) for xy in _generator_comb( _G_CACHE_WINDOW ) )
+			header = _G_CACHE_HEADER.pack( _G_CACHE_MAGIC, _G_CACHE_VERSION, _G_CACHE_WINDOW,
+				cls.rows, cls.parameters() )
+			f = os.fdopen( fd, 'wb' )
+			f.write( header.ljust( _G_CACHE_HEADER_SIZE, '\0' ) + body )
+			f.close()
+			if sys.platform == 'win32' and os.path.exists( path ):
+				os.remove( path )
+			os.rename( temp_path, path )
+		except ( IOError, OSError ):
+			if os.path.exists( temp_path ):
+				os.remove( temp_path )
+			return False
+		return True
+
+	def __init__( self, f, m ):
+		self.file = f
+		self.map = m
+		self.points = [ None ] * ( self.rows * self.size )
+
+	def point( self, i ):
+		"""The affine point at index i ( row * size + j - 1 ), decoded on first use."""
+		xy = self.points[i]
+		if xy is None:
+			offset = _G_CACHE_HEADER_SIZE + 64 * i
+			x = long( self.map[offset:offset+32].encode( 'hex' ), 16 )
+			y = long( self.map[offset+32:offset+64].encode( 'hex' ), 16 )
+			xy = self.points[i] = ( x, y )
+		return xy
+
+	def multiply( self, k ):
+		"""k * G as a Jacobian point, for 0 <= k < n."""
+		size = self.size
+		result = _JACOBIAN_INFINITY
+		i = 0		# index of the first point of the row
+		while k:
+			j = k & size
+			if j:
+				x, y = self.point( i + j - 1 )
+				result = _jacobian_add( result, ( x, y, 1 ), _p, _a )
+			k >>= _G_CACHE_WINDOW
+			i += size
+		return result
+
+def _cached_generator_table():
+	"""The mapped wide table, loaded (and built, or rebuilt, if need be) on
+	first use; False if there is no usable cache directory.
+	"""
+	global _generator_cache
+	if _generator_cache is None:
+		_generator_cache = False
+		directory = determine_cache_dir()
+		if directory is not None:
+			path = os.path.join( directory, _G_CACHE_FILENAME )
+			table = _GeneratorTableFile.open( path )
+			if table is None and _GeneratorTableFile.write( path ):
+				table = _GeneratorTableFile.open( path )
+			if table is not None:
+				_generator_cache = table
+	return _generator_cache
+
+def _warm_generator():
+	"""Load or build whichever generator table _generator_multiply will use."""
+	if not _cached_generator_table():
+		_generator_table()
+
+def _generator_multiply_glv( k ):
+	"""k * G as a Jacobian point, without any generator table."""
+	table = generator_secp256k1._odd_multiples()
+	k1, k2 = _glv_split( k )
+	return _multi_multiply( [ ( table, _signed_wnaf( k1, _WNAF_WIDTH ) ),
+		( _endomorphism( table ), _signed_wnaf( k2, _WNAF_WIDTH ) ) ], _p, _a )
+
+def _generator_multiply( k ):
+	"""k * G as a Jacobian point."""
+	global _generator_multiplications
+	k = k % _r
+	table = _generator_cache if _generator_cache is not None else _cached_generator_table()
+	if table:
+		return table.multiply( k )
+	if _generator_table_rows is None and _generator_multiplications < _G_TABLE_THRESHOLD:
+		_generator_multiplications += 1
+		return _generator_multiply_glv( k )
+	mask = ( 1 << _G_WINDOW ) - 1
+	result = _JACOBIAN_INFINITY
+	for row in _generator_table():
+		if k == 0: break
+		j = k & mask
+		if j:
+			x, y = row[j-1]
+			result = _jacobian_add( result, ( x, y, 1 ), _p, _a )
+		k >>= _G_WINDOW
+	return result
+
 class Signature( object ):
+	__slots__ = ( 'r', 's' )
+
 	def __init__( self, r, s ):
 		self.r = r
 		self.s = s
 		
 class Public_key( object ):
-	def __init__( self, generator, point ):
+	__slots__ = ( 'curve', 'generator', 'point' )
+
+	def __init__( self, generator, point, validate = True ):
 		self.curve = generator.curve()
 		self.generator = generator
 		self.point = point
 		n = generator.order()
 		if not n:
 			raise RuntimeError, "Generator point must have order."
-		if not n * point == INFINITY:
-			raise RuntimeError, "Generator point order is bad."
+		if validate:
+			# on secp256k1 (cofactor 1) every point of the curve has order n,
+			# and _multiply_sum reduces scalars mod n there, so n * point
+			# would not test anything
+			if point == INFINITY or not self.curve.contains_point( point.x(), point.y() ):
+				raise RuntimeError, "Point is not on the curve."
+			if not _is_secp256k1( self.curve ) and not n * point == INFINITY:
+				raise RuntimeError, "Generator point order is bad."
 		if point.x() < 0 or n <= point.x() or point.y() < 0 or n <= point.y():
 			raise RuntimeError, "Generator point has x or y out of range."
 
@@ -188,11 +667,12 @@ class Public_key( object ):
 		c = inverse_mod( s, n )
 		u1 = ( hash * c ) % n
 		u2 = ( r * c ) % n
-		xy = u1 * G + u2 * self.point
-		v = xy.x() % n
-		return v == r
+		xy = _multiply_sum( self.curve, [ ( u1, G ), ( u2, self.point ) ] )
+		return _jacobian_x_mod_n_equals( xy, r, self.curve.p(), n )
 
 class Private_key( object ):
+	__slots__ = ( 'public_key', 'secret_multiplier' )
+
 	def __init__( self, public_key, secret_multiplier ):
 		self.public_key = public_key
 		self.secret_multiplier = secret_multiplier
@@ -217,13 +697,68 @@ class Private_key( object ):
 		return Signature( r, s )
 
 class EC_KEY(object):
-	def __init__( self, secret ):
-		curve = CurveFp( _p, _a, _b )
-		generator = Point( curve, _Gx, _Gy, _r )
-		self.pubkey = Public_key( generator, generator * secret )
+	__slots__ = ( 'pubkey', 'privkey', 'secret' )
+
+	def __init__( self, secret, validate = False, public_point = None ):
+		# the public point is derived here from a valid generator (or handed in
+		# by derive_keys), so it is only re-checked on request
+		generator = generator_secp256k1
+		if public_point is None: public_point = generator * secret
+		self.pubkey = Public_key( generator, public_point, validate )
 		self.privkey = Private_key( self.pubkey, secret )
 		self.secret = secret
 
+def batch_verifies( items ):
+	"""Verify many ( Public_key, hash, Signature ) triples. Returns the
+	indexes of the entries that fail, so an empty list means all of them
+	verify.
+
+	All the s values are inverted with a single inverse_mod, each check is
+	one joint multiplication compared in Jacobian form (no inversion), and
+	repeated public keys reuse their cached tables.
+	"""
+	bad = []
+	checks = []
+	for i, ( public_key, hash, signature ) in enumerate( items ):
+		n = public_key.generator.order()
+		r = signature.r
+		s = signature.s
+		if r < 1 or r > n-1 or s < 1 or s > n-1:
+			bad.append( i )
+		else:
+			checks.append( ( i, public_key, hash, signature, n ) )
+
+	# the s values are inverted mod their own group order; group by it so a
+	# batch mixing curves still needs only one inversion per order
+	by_order = {}
+	for check in checks:
+		by_order.setdefault( check[4], [] ).append( check )
+	for n, group in by_order.items():
+		inverses = _batch_inverse_mod( [ signature.s for i, public_key, hash, signature, n in group ], n )
+		for ( i, public_key, hash, signature, n ), c in zip( group, inverses ):
+			u1 = ( hash * c ) % n
+			u2 = ( signature.r * c ) % n
+			curve = public_key.curve
+			xy = _multiply_sum( curve, [ ( u1, public_key.generator ), ( u2, public_key.point ) ] )
+			if not _jacobian_x_mod_n_equals( xy, signature.r, curve.p(), n ):
+				bad.append( i )
+	bad.sort()
+	return bad
+
+def derive_keys( secrets ):
+	"""EC_KEY objects for a list of secret exponents. The public points are
+	normalized to affine together, with one inversion for the whole batch
+	instead of one per key.
+	"""
+	points = _batch_to_affine( [ _generator_multiply( secret ) for secret in secrets ], _p )
+	keys = []
+	for secret, xy in zip( secrets, points ):
+		if xy is None:
+			raise RuntimeError, "Secret is a multiple of the generator order."
+		point = Point( curve_secp256k1, xy[0], xy[1], validate = False )
+		keys.append( EC_KEY( secret, public_point = point ) )
+	return keys
+
 def i2d_ECPrivateKey(pkey):
 	hex_i2d_key = '308201130201010420' + \
 		'%064x' % pkey.secret + \
@@ -245,6 +780,28 @@ def i2o_ECPublicKey(pkey):
 		'%064x' % pkey.pubkey.point.y()
 	return hex_i2o_key.decode('hex')
 
+def o2i_ECPublicKey(public_key, validate=True):
+	"""Decode an untrusted serialized public key (65-byte uncompressed or
+	33-byte compressed) into a Public_key. Returns None if it is malformed.
+	"""
+	if len(public_key) == 65 and public_key[0] == '\x04':
+		x = str_to_long(public_key[1:33])
+		y = str_to_long(public_key[33:65])
+	elif len(public_key) == 33 and public_key[0] in '\x02\x03':
+		x = str_to_long(public_key[1:33])
+		y = pow((x * x * x + _a * x + _b) % _p, (_p + 1) / 4, _p)
+		if (y & 1) != (ord(public_key[0]) & 1):
+			y = _p - y
+	else:
+		return None
+	if not curve_secp256k1.contains_point(x, y):
+		return None
+	point = Point(curve_secp256k1, x, y, validate=False)
+	try:
+		return Public_key(generator_secp256k1, point, validate)
+	except RuntimeError:
+		return None
+
 # hashes
 
 def hash_160(public_key):
@@ -264,6 +821,8 @@ def hash_160_to_bc_address(h160):
 
 def bc_address_to_hash_160(addr):
 	bytes = b58decode(addr, 25)
+	if bytes is None:
+		return None
 	return bytes[1:21]
 
 def long_hex(bytes):
@@ -277,49 +836,42 @@ def short_hex(bytes):
 
 __b58chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
 __b58base = len(__b58chars)
+# digit value of every byte, -1 for bytes outside the alphabet
+__b58values = [__b58chars.find(chr(i)) for i in xrange(256)]
 
 def b58encode(v):
 	""" encode v, which is a string of bytes, to base58.		
 	"""
 
-	long_value = 0L
-	for (i, c) in enumerate(v[::-1]):
-		long_value += (256**i) * ord(c)
+	long_value = int(v.encode('hex_codec'), 16) if v else 0
 
-	result = ''
+	result = []
 	while long_value >= __b58base:
-		div, mod = divmod(long_value, __b58base)
-		result = __b58chars[mod] + result
-		long_value = div
-	result = __b58chars[long_value] + result
+		long_value, mod = divmod(long_value, __b58base)
+		result.append(__b58chars[mod])
+	result.append(__b58chars[long_value])
+	result.reverse()
 
 	# Bitcoin does a little leading-zero-compression:
 	# leading 0-bytes in the input become leading-1s
-	nPad = 0
-	for c in v:
-		if c == '\0': nPad += 1
-		else: break
+	nPad = len(v) - len(v.lstrip('\0'))
 
-	return (__b58chars[0]*nPad) + result
+	return (__b58chars[0]*nPad) + ''.join(result)
 
 def b58decode(v, length):
-	""" decode v into a string of len bytes
+	""" decode v into a string of len bytes, None if v is not valid base58
 	"""
-	long_value = 0L
-	for (i, c) in enumerate(v[::-1]):
-		long_value += __b58chars.find(c) * (__b58base**i)
-
-	result = ''
-	while long_value >= 256:
-		div, mod = divmod(long_value, 256)
-		result = chr(mod) + result
-		long_value = div
-	result = chr(long_value) + result
-
-	nPad = 0
+	long_value = 0
 	for c in v:
-		if c == __b58chars[0]: nPad += 1
-		else: break
+		digit = __b58values[ord(c)]
+		if digit < 0:
+			return None
+		long_value = long_value * __b58base + digit
+
+	result = '%x' % long_value
+	result = ('0' * (len(result) & 1) + result).decode('hex_codec')
+
+	nPad = len(v) - len(v.lstrip(__b58chars[0]))
 
 	result = chr(0)*nPad + result
 	if length is not None and len(result) != length:
@@ -327,6 +879,16 @@ def b58decode(v, length):
 
 	return result
 
+def b58encode_many(vs):
+	""" encode a list of byte strings, see b58encode
+	"""
+	return map(b58encode, vs)
+
+def b58decode_many(vs, length):
+	""" decode a list of base58 strings, see b58decode
+	"""
+	return [b58decode(v, length) for v in vs]
+
 def long_hex(bytes):
 	return bytes.encode('hex_codec')
 
@@ -339,6 +901,8 @@ def EncodeBase58Check(vchIn):
 
 def DecodeBase58Check(psz):
 	vchRet = b58decode(psz, None)
+	if vchRet is None:
+		return None
 	key = vchRet[0:-4]
 	csum = vchRet[-4:]
 	hash = Hash(key)
@@ -379,8 +943,31 @@ def regenerate_key(sec):
 	if not b:
 		return False
 	secret = str_to_long(b)	
+	if not 0 < secret < _r:
+		return False
 	return EC_KEY(secret)
 
+def regenerate_keys(secs):
+	"""Batch version of regenerate_key: a list of EC_KEY objects, or False
+	for each secret that does not decode.
+	"""
+	secrets = []
+	for sec in secs:
+		b = ASecretToSecret(sec)
+		secret = str_to_long(b) if b else 0
+		secrets.append(secret if 0 < secret < _r else None)
+	keys = iter(derive_keys([secret for secret in secrets if secret is not None]))
+	return [keys.next() if secret is not None else False for secret in secrets]
+
+def derive_addresses(secrets):
+	"""(public key, address) pairs for a list of secret exponents."""
+	public_keys = map(i2o_ECPublicKey, derive_keys(secrets))
+	payloads = []
+	for public_key in public_keys:
+		vh160 = chr(addrtype) + hash_160(public_key)
+		payloads.append(vh160 + Hash(vh160)[0:4])
+	return zip(public_keys, b58encode_many(payloads))
+
 def GetPubKey(pkey):
 	return i2o_ECPublicKey(pkey)
 
@@ -390,431 +977,110 @@ def GetPrivKey(pkey):
 def GetSecret(pkey):
 	return ('%064x' % pkey.secret).decode('hex')
 
-# parser
-
-def create_env(db_dir):
-	db_env = DBEnv(0)
-	r = db_env.open(db_dir, (DB_CREATE|DB_INIT_LOCK|DB_INIT_LOG|DB_INIT_MPOOL|DB_INIT_TXN|DB_THREAD|DB_RECOVER))
-	return db_env
-
-def parse_CAddress(vds):
-	d = {'ip':'0.0.0.0','port':0,'nTime': 0}
-	try:
-		d['nVersion'] = vds.read_int32()
-		d['nTime'] = vds.read_uint32()
-		d['nServices'] = vds.read_uint64()
-		d['pchReserved'] = vds.read_bytes(12)
-		d['ip'] = socket.inet_ntoa(vds.read_bytes(4))
-		d['port'] = vds.read_uint16()
-	except:
-		pass
-	return d
-
-def deserialize_CAddress(d):
-	return d['ip']+":"+str(d['port'])
-
-def parse_BlockLocator(vds):
-	d = { 'hashes' : [] }
-	nHashes = vds.read_compact_size()
-	for i in xrange(nHashes):
-		d['hashes'].append(vds.read_bytes(32))
-		return d
-
-def deserialize_BlockLocator(d):
-  result = "Block Locator top: "+d['hashes'][0][::-1].encode('hex_codec')
-  return result
-
-def parse_setting(setting, vds):
-	if setting[0] == "f":	# flag (boolean) settings
-		return str(vds.read_boolean())
-	elif setting[0:4] == "addr": # CAddress
-		d = parse_CAddress(vds)
-		return deserialize_CAddress(d)
-	elif setting == "nTransactionFee":
-		return vds.read_int64()
-	elif setting == "nLimitProcessors":
-		return vds.read_int32()
-	return 'unknown setting'
-
-class SerializationError(Exception):
-	""" Thrown when there's a problem deserializing or serializing """
-
-class BCDataStream(object):
-	def __init__(self):
-		self.input = None
-		self.read_cursor = 0
-
-	def clear(self):
-		self.input = None
-		self.read_cursor = 0
-
-	def write(self, bytes):	# Initialize with string of bytes
-		if self.input is None:
-			self.input = bytes
-		else:
-			self.input += bytes
-
-	def map_file(self, file, start):	# Initialize with bytes from file
-		self.input = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
-		self.read_cursor = start
-	def seek_file(self, position):
-		self.read_cursor = position
-	def close_file(self):
-		self.input.close()
-
-	def read_string(self):
-		# Strings are encoded depending on length:
-		# 0 to 252 :	1-byte-length followed by bytes (if any)
-		# 253 to 65,535 : byte'253' 2-byte-length followed by bytes
-		# 65,536 to 4,294,967,295 : byte '254' 4-byte-length followed by bytes
-		# ... and the Bitcoin client is coded to understand:
-		# greater than 4,294,967,295 : byte '255' 8-byte-length followed by bytes of string
-		# ... but I don't think it actually handles any strings that big.
-		if self.input is None:
-			raise SerializationError("call write(bytes) before trying to deserialize")
-
-		try:
-			length = self.read_compact_size()
-		except IndexError:
-			raise SerializationError("attempt to read past end of buffer")
-
-		return self.read_bytes(length)
-
-	def write_string(self, string):
-		# Length-encoded as with read-string
-		self.write_compact_size(len(string))
-		self.write(string)
-
-	def read_bytes(self, length):
-		try:
-			result = self.input[self.read_cursor:self.read_cursor+length]
-			self.read_cursor += length
-			return result
-		except IndexError:
-			raise SerializationError("attempt to read past end of buffer")
-
-		return ''
-
-	def read_boolean(self): return self.read_bytes(1)[0] != chr(0)
-	def read_int16(self): return self._read_num('<h')
-	def read_uint16(self): return self._read_num('<H')
-	def read_int32(self): return self._read_num('<i')
-	def read_uint32(self): return self._read_num('<I')
-	def read_int64(self): return self._read_num('<q')
-	def read_uint64(self): return self._read_num('<Q')
-
-	def write_boolean(self, val): return self.write(chr(1) if val else chr(0))
-	def write_int16(self, val): return self._write_num('<h', val)
-	def write_uint16(self, val): return self._write_num('<H', val)
-	def write_int32(self, val): return self._write_num('<i', val)
-	def write_uint32(self, val): return self._write_num('<I', val)
-	def write_int64(self, val): return self._write_num('<q', val)
-	def write_uint64(self, val): return self._write_num('<Q', val)
-
-	def read_compact_size(self):
-		size = ord(self.input[self.read_cursor])
-		self.read_cursor += 1
-		if size == 253:
-			size = self._read_num('<H')
-		elif size == 254:
-			size = self._read_num('<I')
-		elif size == 255:
-			size = self._read_num('<Q')
-		return size
-
-	def write_compact_size(self, size):
-		if size < 0:
-			raise SerializationError("attempt to write size < 0")
-		elif size < 253:
-			 self.write(chr(size))
-		elif size < 2**16:
-			self.write('\xfd')
-			self._write_num('<H', size)
-		elif size < 2**32:
-			self.write('\xfe')
-			self._write_num('<I', size)
-		elif size < 2**64:
-			self.write('\xff')
-			self._write_num('<Q', size)
-
-	def _read_num(self, format):
-		(i,) = struct.unpack_from(format, self.input, self.read_cursor)
-		self.read_cursor += struct.calcsize(format)
-		return i
-
-	def _write_num(self, format, num):
-		s = struct.pack(format, num)
-		self.write(s)
-
-def open_wallet(db_env, writable=False):
-	db = DB(db_env)
-	flags = DB_THREAD | (DB_CREATE if writable else DB_RDONLY)
-	try:
-		r = db.open("wallet.dat", "main", DB_BTREE, flags)
-	except DBError:
-		r = True
-
-	if r is not None:
-		logging.error("Couldn't open wallet.dat/main. Try quitting Bitcoin and running this again.")
-		sys.exit(1)
-	
-	return db
-
-def parse_wallet(db, item_callback):
-	kds = BCDataStream()
-	vds = BCDataStream()
-
-	for (key, value) in db.items():
-		d = { }
-
-		kds.clear(); kds.write(key)
-		vds.clear(); vds.write(value)
-
-		type = kds.read_string()
-
-		d["__key__"] = key
-		d["__value__"] = value
-		d["__type__"] = type
-
-		try:
-			if type == "tx":
-				d["tx_id"] = kds.read_bytes(32)
-			elif type == "name":
-				d['hash'] = kds.read_string()
-				d['name'] = vds.read_string()
-			elif type == "version":
-				d['version'] = vds.read_uint32()
-			elif type == "setting":
-				d['setting'] = kds.read_string()
-				d['value'] = parse_setting(d['setting'], vds)
-			elif type == "key":
-				d['public_key'] = kds.read_bytes(kds.read_compact_size())
-				d['private_key'] = vds.read_bytes(vds.read_compact_size())
-			elif type == "wkey":
-				d['public_key'] = kds.read_bytes(kds.read_compact_size())
-				d['private_key'] = vds.read_bytes(vds.read_compact_size())
-				d['created'] = vds.read_int64()
-				d['expires'] = vds.read_int64()
-				d['comment'] = vds.read_string()
-			elif type == "defaultkey":
-				d['key'] = vds.read_bytes(vds.read_compact_size())
-			elif type == "pool":
-				d['n'] = kds.read_int64()
-				d['nVersion'] = vds.read_int32()
-				d['nTime'] = vds.read_int64()
-				d['public_key'] = vds.read_bytes(vds.read_compact_size())
-			elif type == "acc":
-				d['account'] = kds.read_string()
-				d['nVersion'] = vds.read_int32()
-				d['public_key'] = vds.read_bytes(vds.read_compact_size())
-			elif type == "acentry":
-				d['account'] = kds.read_string()
-				d['n'] = kds.read_uint64()
-				d['nVersion'] = vds.read_int32()
-				d['nCreditDebit'] = vds.read_int64()
-				d['nTime'] = vds.read_int64()
-				d['otherAccount'] = vds.read_string()
-				d['comment'] = vds.read_string()
-			elif type == "bestblock":
-				d['nVersion'] = vds.read_int32()
-				d.update(parse_BlockLocator(vds))
-			
-			item_callback(type, d)
-
-		except Exception, e:
-			traceback.print_exc()
-			print("ERROR parsing wallet.dat, type %s" % type)
-			print("key data in hex: %s"%key.encode('hex_codec'))
-			print("value data in hex: %s"%value.encode('hex_codec'))
-			sys.exit(1)
-	
-def update_wallet(db, type, data):
-	"""Write a single item to the wallet.
-	db must be open with writable=True.
-	type and data are the type code and data dictionary as parse_wallet would
-	give to item_callback.
-	data's __key__, __value__ and __type__ are ignored; only the primary data
-	fields are used.
-	"""
-	d = data
-	kds = BCDataStream()
-	vds = BCDataStream()
-
-	# Write the type code to the key
-	kds.write_string(type)
-	vds.write("")						 # Ensure there is something
+from optparse import OptionParser
 
-	try:
-		if type == "tx":
-			raise NotImplementedError("Writing items of type 'tx'")
-			kds.write(d['tx_id'])
-		elif type == "name":
-			kds.write_string(d['hash'])
-			vds.write_string(d['name'])
-		elif type == "version":
-			vds.write_uint32(d['version'])
-		elif type == "setting":
-			raise NotImplementedError("Writing items of type 'setting'")
-			kds.write_string(d['setting'])
-			#d['value'] = parse_setting(d['setting'], vds)
-		elif type == "key":
-			kds.write_string(d['public_key'])
-			vds.write_string(d['private_key'])
-		elif type == "wkey":
-			kds.write_string(d['public_key'])
-			vds.write_string(d['private_key'])
-			vds.write_int64(d['created'])
-			vds.write_int64(d['expires'])
-			vds.write_string(d['comment'])
-		elif type == "defaultkey":
-			vds.write_string(d['key'])
-		elif type == "pool":
-			kds.write_int64(d['n'])
-			vds.write_int32(d['nVersion'])
-			vds.write_int64(d['nTime'])
-			vds.write_string(d['public_key'])
-		elif type == "acc":
-			kds.write_string(d['account'])
-			vds.write_int32(d['nVersion'])
-			vds.write_string(d['public_key'])
-		elif type == "acentry":
-			kds.write_string(d['account'])
-			kds.write_uint64(d['n'])
-			vds.write_int32(d['nVersion'])
-			vds.write_int64(d['nCreditDebit'])
-			vds.write_int64(d['nTime'])
-			vds.write_string(d['otherAccount'])
-			vds.write_string(d['comment'])
-		else:
-			print "Unknown key type: "+type
+def main():
 
-		# Write the key/value pair to the database
-		db.put(kds.input, vds.input)
+	global max_version, addrtype
 
-	except Exception, e:
-		print("ERROR writing to wallet.dat, type %s"%type)
-		print("data dictionary: %r"%data)
-		traceback.print_exc()
+	parser = OptionParser(usage="%prog [options]", version="%prog 0.1")
 
-def rewrite_wallet(db_env, destFileName, pre_put_callback=None):
-	db = open_wallet(db_env)
+	parser.add_option("--phrase", dest="keystr", 
+		help="convert the passphrase \"KEYSTR\" to a private key base 58 hash")
 
-	db_out = DB(db_env)
-	try:
-		r = db_out.open(destFileName, "main", DB_BTREE, DB_CREATE)
-	except DBError:
-		r = True
+	parser.add_option("--datadir", dest="datadir", default=determine_db_dir(),
+		help="wallet directory (defaults to bitcoin default)")
 
-	if r is not None:
-		logging.error("Couldn't open %s."%destFileName)
-		sys.exit(1)
+	parser.add_option("--dumpwallet", dest="dump", action="store_true",
+		help="dump the wallet in DATADIR as JSON")
 
-	def item_callback(type, d):
-		if (pre_put_callback is None or pre_put_callback(type, d)):
-			db_out.put(d["__key__"], d["__value__"])
+	parser.add_option("--exportwallet", dest="export", action="store_true",
+		help="write the records of the wallet in DATADIR to stdout as they are read, one JSON object per line")
 
-	parse_wallet(db, item_callback)
-	db_out.close()
-	db.close()
+	parser.add_option("--nodbenv", dest="nodbenv", action="store_true",
+		help="read wallet.dat for --dumpwallet or --exportwallet directly, without opening a database environment")
 
-def read_wallet(json_db, db_env, print_wallet, print_wallet_transactions, transaction_filter):
-	db = open_wallet(db_env)
+	parser.add_option("--workers", dest="workers", type="int", default=1,
+		help="derive addresses and keys for --dumpwallet in WORKERS processes")
 
-	json_db['keys'] = []
-	json_db['pool'] = []
-	json_db['names'] = {}
+	parser.add_option("--chunksize", dest="chunksize", type="int", default=1000,
+		help="records per work unit with --workers")
 
-	def item_callback(type, d):
+	parser.add_option("--importprivkeys", dest="keyfile",
+		help="import the WIF private keys listed in KEYFILE, one per line (- for stdin)")
 
-		if type == "name":
-			json_db['names'][d['hash']] = d['name']
+	parser.add_option("--commitsize", dest="commitsize", type="int", default=1000,
+		help="write at most COMMITSIZE records per transaction when importing")
 
-		elif type == "version":
-			json_db['version'] = d['version']
+	parser.add_option("--nosync", dest="nosync", action="store_true",
+		help="do not flush the log to disk on every import transaction but the last")
 
-		elif type == "setting":
-			if not json_db.has_key('settings'): json_db['settings'] = {}
-			json_db["settings"][d['setting']] = d['value']
+	parser.add_option("--stats", dest="stats", action="store_true",
+		help="print operation counts and the time spent in each stage to stderr (not with --daemon)")
 
-		elif type == "defaultkey":
-			json_db['defaultkey'] = public_key_to_bc_address(d['key'])
+	parser.add_option("--daemon", dest="socket",
+		help="serve derive, encode, sign, verify and wallet requests on the Unix socket SOCKET")
 
-		elif type == "key":
-			addr = public_key_to_bc_address(d['public_key'])
-			sec = SecretToASecret(PrivKeyToSecret(d['private_key']))
-			private_keys.append(sec)
-			json_db['keys'].append({'addr' : addr, 'sec' : sec})
+	(options, args) = parser.parse_args()
 
-		elif type == "wkey":
-			if not json_db.has_key('wkey'): json_db['wkey'] = []
-			json_db['wkey']['created'] = d['created']
+	if options.keystr is None and options.keyfile is None and not options.dump and not options.export \
+			and not options.socket:
+		print "A mandatory option is missing\n"
+		parser.print_help()
+		exit(0)
 
-		elif type == "pool":
-			json_db['pool'].append( {'n': d['n'], 'addr': public_key_to_bc_address(d['public_key']), 'nTime' : d['nTime'] } )
+	if options.commitsize < 1:
+		parser.error("--commitsize must be at least 1")
 
-		elif type == "acc":
-			json_db['acc'] = d['account']
-			print("Account %s (current key: %s)"%(d['account'], public_key_to_bc_address(d['public_key'])))
+	if options.chunksize < 1:
+		parser.error("--chunksize must be at least 1")
 
-		elif type == "acentry":
-			json_db['acentry'] = (d['account'], d['nCreditDebit'], d['otherAccount'], time.ctime(d['nTime']), d['n'], d['comment'])
+	# the counters are process-wide, not per request, and the daemon never
+	# gets to print them
+	if options.stats and options.socket:
+		parser.error("--stats cannot be used with --daemon")
 
-		elif type == "bestblock":
-			json_db['bestblock'] = d['hashes'][0][::-1].encode('hex_codec')
+	if options.stats:
+		import instrument
+		if options.dump or options.export or options.keyfile:
+			import walletdb
+		instrument.enable()
 
+	if options.dump:
+		import json
+		import walletdb
+		if options.nodbenv:
+			(db_env, db) = (None, walletdb.open_wallet_file(options.datadir))
 		else:
-			json_db[type] = 'unsupported'
-
-
-	parse_wallet(db, item_callback)
-
-	db.close()
-
-	for k in json_db['keys']:
-		addr = k['addr']
-		if addr in json_db['names'].keys():
-			k["label"] = json_db['names'][addr]
+			(db_env, db) = (walletdb.create_env(options.datadir), None)
+		json_db = {}
+		walletdb.read_wallet(json_db, db_env, True, True, "", workers=options.workers, chunk_size=options.chunksize, db=db)
+		if db is not None:
+			db.close()
+		print json.dumps(json_db, sort_keys=True, indent=4)
+
+	if options.export:
+		import walletdb
+		if options.nodbenv:
+			db = walletdb.open_wallet_file(options.datadir)
 		else:
-			k["reserve"] = 1
-	
-	del(json_db['pool'])
-	del(json_db['names'])
-
-def importprivkey(db, sec):
-	pkey = regenerate_key(sec)
-	if not pkey:
-		return False
-
-	secret = GetSecret(pkey)
-	private_key = GetPrivKey(pkey)
-	public_key = GetPubKey(pkey)
-	addr = public_key_to_bc_address(public_key)
-
-	print "Address: %s" % addr
-	print "Privkey: %s" % SecretToASecret(secret)
-
-	update_wallet(db, 'key', { 'public_key' : public_key, 'private_key' : private_key })
-	update_wallet(db, 'name', { 'hash' : addr, 'name' : '' })
-
-	return True
-
-from optparse import OptionParser
-
-def main():
-
-	global max_version, addrtype
-
-	parser = OptionParser(usage="%prog [options]", version="%prog 0.1")
-
-	parser.add_option("--phrase", dest="keystr", 
-		help="convert the passphrase \"KEYSTR\" to a private key base 58 hash")
-
-	(options, args) = parser.parse_args()
-
-	if options.keystr is None:
-		print "A mandatory option is missing\n"
-		parser.print_help()
-		exit(0)
+			db = walletdb.open_wallet(walletdb.create_env(options.datadir))
+		walletdb.export_wallet(db, sys.stdout)
+		db.close()
+
+	if options.keyfile:
+		import walletdb
+		f = sys.stdin if options.keyfile == '-' else open(options.keyfile)
+		secs = [line.strip() for line in f if line.strip()]
+		db_env = walletdb.create_env(options.datadir)
+		db = walletdb.open_wallet(db_env, writable=True)
+		addrs = walletdb.importprivkeys(db_env, db, secs, options.commitsize,
+			walletdb.DB_TXN_NOSYNC if options.nosync else 0)
+		db.close()
+		for (sec, addr) in zip(secs, addrs):
+			if not addr:
+				print "Invalid private key: %s" % sec
+		print "Imported %d of %d keys" % (len(filter(None, addrs)), len(secs))
 
 	if options.keystr:
 		#Take sha256 hash of key string
@@ -838,6 +1104,14 @@ def main():
 		print "Public address: " + bc_add+"\r"
 		print "Privey: "+priv_key+"\n"
 
+	if options.socket:
+		import convertd
+		convertd.serve(options.socket, options.datadir, options.nodbenv)
+
+	if options.stats:
+		for line in instrument.format_snapshot(instrument.snapshot()):
+			sys.stderr.write(line + "\n")
+
 
 # Depricated
 #Works
@@ -880,4 +1154,7 @@ def main():
 
 
 if __name__ == '__main__':
+	# modules imported later (walletdb) must see this module as convertphrase,
+	# not load a second copy of it
+	sys.modules.setdefault('convertphrase', sys.modules[__name__])
 	main()
@@ -0,0 +1,183 @@
+# Operation counters and per-stage timing for convertphrase.py and walletdb.py.
+#
+# Nothing here costs anything until enable() is called: it then replaces the
+# instrumented functions in the loaded modules with counting and timing
+# wrappers, and disable() puts the originals back.  main() does this for
+# --stats.  Work done in --workers processes is not seen, and the stage
+# timing assumes a single thread, so --stats is refused with --daemon.
+#
+# Stage times are exclusive: when a stage calls into another (an address
+# encoding hashing a public key, say), the time is charged to the inner one.
+
+import sys
+from timeit import default_timer
+
+# (module, function, counter, stage); counter or stage may be None
+_EC_FUNCTIONS = [
+	('convertphrase', '_jacobian_add', 'point_add', None),
+	('convertphrase', '_jacobian_double', 'point_double', None),
+	('convertphrase', 'inverse_mod', 'inverse_mod', 'ec'),
+	('convertphrase', '_generator_multiply', None, 'ec'),
+	('convertphrase', '_multiply_sum', None, 'ec'),
+	('convertphrase', '_batch_to_affine', None, 'ec'),
+	('convertphrase', '_jacobian_to_point', None, 'ec'),
+	('convertphrase', 'hash_160', 'hash_160', 'encode'),
+	('convertphrase', 'Hash', 'hash256', 'encode'),
+	('convertphrase', 'b58encode', 'b58encode', 'encode'),
+	('convertphrase', 'b58decode', 'b58decode', 'encode'),
+	('convertphrase', 'i2o_ECPublicKey', None, 'encode'),
+	('convertphrase', 'i2d_ECPrivateKey', None, 'encode'),
+	('walletdb', 'wallet_record', None, 'decode'),
+]
+
+# (module, class, method, counter, stage)
+_METHODS = [
+	('convertphrase', 'Point', '__add__', 'point_add', None),
+	('convertphrase', 'Point', 'double', 'point_double', None),
+	('walletdb', 'WalletRecord', '_decode', None, 'decode'),
+]
+
+# generator functions, timed per item
+_ITERATORS = [
+	('walletdb', 'iter_db', 'db_read'),
+	('walletdb', 'iter_db_prefix', 'db_read'),
+]
+
+STAGES = ('db_read', 'decode', 'ec', 'encode')
+
+counters = {}
+records = {}
+stages = {}
+_stack = []			# [stage, start] of the stages being timed, innermost last
+_patched = []		# (object, name, original)
+
+def reset():
+	counters.clear()
+	records.clear()
+	for stage in STAGES:
+		stages[stage] = 0.0
+
+def snapshot():
+	"""The counts and stage times so far: {'counters': {name: n}, 'records':
+	{type: n}, 'stages': {stage: seconds}}.
+	"""
+	return {'counters': dict(counters), 'records': dict(records), 'stages': dict(stages)}
+
+def _enter(stage):
+	now = default_timer()
+	if _stack:
+		top = _stack[-1]
+		stages[top[0]] += now - top[1]
+	_stack.append([stage, now])
+
+def _leave():
+	now = default_timer()
+	(stage, start) = _stack.pop()
+	stages[stage] += now - start
+	if _stack:
+		_stack[-1][1] = now
+
+def _wrap(f, counter, stage):
+	if stage is None:
+		def wrapper(*args, **kwargs):
+			counters[counter] = counters.get(counter, 0) + 1
+			return f(*args, **kwargs)
+	else:
+		def wrapper(*args, **kwargs):
+			if counter is not None:
+				counters[counter] = counters.get(counter, 0) + 1
+			_enter(stage)
+			try:
+				return f(*args, **kwargs)
+			finally:
+				_leave()
+	wrapper.__name__ = f.__name__
+	wrapper.__doc__ = f.__doc__
+	return wrapper
+
+def _wrap_iterator(f, stage):
+	def wrapper(*args, **kwargs):
+		it = f(*args, **kwargs)
+		while True:
+			_enter(stage)
+			try:
+				item = next(it)
+			except StopIteration:
+				return
+			finally:
+				_leave()
+			yield item
+	wrapper.__name__ = f.__name__
+	wrapper.__doc__ = f.__doc__
+	return wrapper
+
+def _count_records(f):
+	def wrapper(key, value):
+		d = f(key, value)
+		records[d.type] = records.get(d.type, 0) + 1
+		return d
+	wrapper.__name__ = f.__name__
+	wrapper.__doc__ = f.__doc__
+	return wrapper
+
+def _replace(module_names, original, replacement):
+	# the function may also have been imported into the other modules
+	# (walletdb imports hash_160 and friends from convertphrase)
+	for module_name in module_names:
+		module = sys.modules[module_name]
+		for (name, value) in vars(module).items():
+			if value is original:
+				setattr(module, name, replacement)
+				_patched.append((module, name, original))
+
+def enable():
+	"""Start counting. Instruments convertphrase and, if it has already been
+	imported, walletdb; import walletdb first to see the wallet stages.
+	"""
+	if _patched:
+		return
+	reset()
+	import convertphrase
+	loaded = [name for name in ('convertphrase', 'walletdb') if name in sys.modules]
+	for (module_name, name, counter, stage) in _EC_FUNCTIONS:
+		if module_name not in loaded:
+			continue
+		original = getattr(sys.modules[module_name], name)
+		replacement = _wrap(original, counter, stage)
+		if name == 'wallet_record':
+			replacement = _count_records(replacement)
+		_replace(loaded, original, replacement)
+	for (module_name, class_name, name, counter, stage) in _METHODS:
+		if module_name not in loaded:
+			continue
+		cls = getattr(sys.modules[module_name], class_name)
+		original = cls.__dict__[name]
+		setattr(cls, name, _wrap(original, counter, stage))
+		_patched.append((cls, name, original))
+	for (module_name, name, stage) in _ITERATORS:
+		if module_name not in loaded:
+			continue
+		original = getattr(sys.modules[module_name], name)
+		_replace(loaded, original, _wrap_iterator(original, stage))
+
+def disable():
+	"""Stop counting and restore the original functions; the counts are kept
+	until the next enable() or reset().
+	"""
+	while _patched:
+		(obj, name, original) = _patched.pop()
+		setattr(obj, name, original)
+	del _stack[:]
+
+def format_snapshot(snap):
+	"""The snapshot as lines of text, for --stats."""
+	lines = []
+	for name in sorted(snap['counters']):
+		lines.append("%-20s %12d" % (name, snap['counters'][name]))
+	for type in sorted(snap['records']):
+		lines.append("%-20s %12d" % ("records." + type, snap['records'][type]))
+	for stage in STAGES:
+		lines.append("%-20s %12.3f s" % ("stage." + stage, snap['stages'].get(stage, 0.0)))
+	return lines
+
+reset()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+#
+# Regenerates wallet.dat for test_btree.py through libdb itself (5.x, via
+# ctypes): python tests/data/make_wallet.py [path to libdb]
+
+import os, sys
+import ctypes
+import ctypes.util
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from test_btree import fixture_records, WALLET_FILE
+
+DB_BTREE = 1
+DB_CREATE = 1
+PAGE_SIZE = 512
+
+class DBT(ctypes.Structure):
+	_fields_ = [('data', ctypes.c_void_p), ('size', ctypes.c_uint32), ('ulen', ctypes.c_uint32),
+		('dlen', ctypes.c_uint32), ('doff', ctypes.c_uint32), ('app_data', ctypes.c_void_p),
+		('flags', ctypes.c_uint32)]
+
+def _dbt(data):
+	buf = ctypes.create_string_buffer(data, len(data))
+	return (buf, DBT(ctypes.cast(buf, ctypes.c_void_p), len(data)))
+
+def write(lib, path, records):
+	if os.path.exists(path):
+		os.remove(path)
+	db = ctypes.c_void_p()
+	assert lib.db_create(ctypes.byref(db), None, 0) == 0
+	assert lib.__db_set_pagesize(db, PAGE_SIZE) == 0
+	# the DB method implementations, called directly rather than through
+	# the function pointers of the DB handle
+	assert lib.__db_open_pp(db, None, path, "main", DB_BTREE, DB_CREATE, 0644) == 0
+	for (key, value) in records:
+		(kbuf, kdbt) = _dbt(key)
+		(vbuf, vdbt) = _dbt(value)
+		assert lib.__db_put_pp(db, None, ctypes.byref(kdbt), ctypes.byref(vdbt), 0) == 0
+	assert lib.__db_close_pp(db, 0) == 0
+
+def main():
+	name = sys.argv[1] if len(sys.argv) > 1 else ctypes.util.find_library('db') or 'libdb-5.3.so'
+	write(ctypes.CDLL(name), WALLET_FILE, fixture_records())
+	print "wrote %s" % WALLET_FILE
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,60 @@
+# Run with: python -m unittest discover -s tests
+
+import os, sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import convertphrase
+from convertphrase import b58encode, b58decode
+
+# (hex, base58) pairs from Bitcoin Core's base58_encode_decode.json
+VECTORS = [
+	('61', '2g'),
+	('626262', 'a3gV'),
+	('636363', 'aPEr'),
+	('572e4794', '3EFU7m'),
+	('10c8511e', 'Rt5zm'),
+	('516b6fcd0f', 'ABnLTmg'),
+	('bf4f89001e670274dd', '3SEo3LWLoPntC'),
+	('ecac89cad93923c02321', 'EJDM8drfXA6uyA'),
+	('00eb15231dfceb60925886b67d065299925915aeb172c06647', '1NS17iag9jJgTHD1VXjvLCEnZuQ3rJDE9L'),
+	('000111d38e5fc9071ffcd20b4a763cc9ae4f252bb4e48fd66a835e252ada93ff480d6dd43dc62a641155a5',
+		'123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'),
+]
+
+class Base58Test(unittest.TestCase):
+
+	def test_vectors(self):
+		for (data, encoded) in VECTORS:
+			data = data.decode('hex')
+			self.assertEqual(b58encode(data), encoded)
+			self.assertEqual(b58decode(encoded, len(data)), data)
+			self.assertEqual(b58decode(encoded, None), data)
+
+	def test_round_trip(self):
+		rnd = random.Random(1)
+		for zeros in (0, 1, 2, 5):
+			for length in (1, 20, 25, 37):
+				data = '\0' * zeros + chr(rnd.randrange(1, 256)) + \
+					''.join(chr(rnd.randrange(256)) for i in range(length - 1))
+				encoded = b58encode(data)
+				self.assertEqual(encoded[:zeros], '1' * zeros)
+				self.assertNotEqual(encoded[zeros:zeros+1], '1')
+				self.assertEqual(b58decode(encoded, len(data)), data)
+		self.assertEqual(convertphrase.b58decode_many(convertphrase.b58encode_many(['\0\x01', 'ab']), None),
+			['\0\x01', 'ab'])
+
+	def test_invalid(self):
+		self.assertEqual(b58decode('0OIl', None), None)
+		self.assertEqual(b58decode('2g', 2), None)
+
+	def test_check(self):
+		payload = '\0' + 'x' * 20
+		encoded = convertphrase.EncodeBase58Check(payload)
+		self.assertEqual(convertphrase.DecodeBase58Check(encoded), payload)
+		broken = encoded[:-1] + ('2' if encoded[-1] != '2' else '3')
+		self.assertEqual(convertphrase.DecodeBase58Check(broken), None)
+
+if __name__ == '__main__':
+	unittest.main()
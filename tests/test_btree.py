@@ -0,0 +1,89 @@
+# Run with: python -m unittest discover -s tests
+#
+# data/wallet.dat is a real Berkeley DB 5.3 btree file with a "main"
+# subdatabase, as wallet.dat files have, holding the records of
+# fixture_records().  Its pages are 512 bytes so that the tree has internal
+# pages and overflow items.  data/make_wallet.py regenerates it.
+
+import os, sys
+import hashlib
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import convertphrase
+import walletdb
+from test_ec import TemporaryCacheDir
+
+WALLET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'wallet.dat')
+
+def _blob(seed, length):
+	data = ''
+	while len(data) < length:
+		data += hashlib.sha256('%s %d' % (seed, len(data))).digest()
+	return data[:length]
+
+def fixture_records():
+	"""The (key, value) pairs of data/wallet.dat, in B-tree order."""
+	keys = convertphrase.derive_keys(range(1, 21))
+	public_keys = [convertphrase.GetPubKey(k) for k in keys]
+	records = [
+		walletdb.encode_wallet_record('version', {'version': 60000}),
+		walletdb.encode_wallet_record('defaultkey', {'key': public_keys[0]}),
+	]
+	for k in keys:
+		records.append(walletdb.encode_wallet_record('key',
+			{'public_key': convertphrase.GetPubKey(k), 'private_key': convertphrase.GetPrivKey(k)}))
+	for i in range(8):
+		records.append(walletdb.encode_wallet_record('name',
+			{'hash': convertphrase.public_key_to_bc_address(public_keys[i]), 'name': 'label %d' % i}))
+	for i in range(10):
+		records.append(walletdb.encode_wallet_record('pool',
+			{'n': i, 'nVersion': 60000, 'nTime': 1300000000 + i, 'public_key': public_keys[10 + i]}))
+	for i in range(2):
+		records.append(walletdb.encode_wallet_record('acentry',
+			{'account': 'acct', 'n': i, 'nVersion': 60000, 'nCreditDebit': 1000 * i, 'nTime': 1300000000,
+			'otherAccount': '', 'comment': 'move %d' % i}))
+	# transactions: one larger than a page, stored on overflow pages
+	for (i, length) in enumerate((300, 1500)):
+		kds = walletdb.BCDataStream()
+		kds.write_string('tx')
+		kds.write(_blob('txid', 32 + i)[i:])
+		records.append((kds.getvalue(), _blob('tx %d' % i, length)))
+	records.sort()
+	return records
+
+class WalletFileTest(TemporaryCacheDir, unittest.TestCase):
+
+	def setUp(self):
+		TemporaryCacheDir.setUp(self)
+		self.db = walletdb.BTreeFile(WALLET_FILE, "main")
+
+	def tearDown(self):
+		self.db.close()
+		TemporaryCacheDir.tearDown(self)
+
+	def test_items(self):
+		self.assertEqual(self.db.items(), fixture_records())
+
+	def test_get_and_prefix_scan(self):
+		records = fixture_records()
+		for (key, value) in records:
+			self.assertEqual(self.db.get(key), value)
+		self.assertEqual(self.db.get('\x04name\x00'), None)
+		prefix = walletdb.wallet_type_prefix('pool')
+		self.assertEqual(list(walletdb.iter_db_prefix(self.db, prefix)),
+			[(key, value) for (key, value) in records if key.startswith(prefix)])
+
+	def test_load_wallet(self):
+		wallet = walletdb.load_wallet(None, db=self.db)
+		self.assertEqual(len(wallet.keys), 20)
+		self.assertEqual(len(wallet.names), 8)
+		addr = convertphrase.public_key_to_bc_address(convertphrase.GetPubKey(convertphrase.EC_KEY(1)))
+		self.assertEqual(wallet.label(addr), 'label 0')
+		self.assertEqual(walletdb.label_of(self.db, addr), 'label 0')
+
+	def test_missing_subdatabase(self):
+		self.assertRaises(Exception, walletdb.BTreeFile, WALLET_FILE, "other")
+
+if __name__ == '__main__':
+	unittest.main()
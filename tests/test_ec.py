@@ -0,0 +1,199 @@
+# Run with: python -m unittest discover -s tests
+
+import os, sys
+import hashlib
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import convertphrase
+from convertphrase import Point, Public_key, EC_KEY, Signature, curve_secp256k1, generator_secp256k1
+from convertphrase import _p, _r, _Gx, _Gy
+
+# A plain affine double-and-add, sharing no code with convertphrase, that
+# the fast paths are checked against; None is the point at infinity.
+
+def ref_add(P, Q):
+	if P is None: return Q
+	if Q is None: return P
+	if P[0] == Q[0]:
+		if (P[1] + Q[1]) % _p == 0:
+			return None
+		l = 3 * P[0] * P[0] * pow(2 * P[1], _p - 2, _p) % _p
+	else:
+		l = (Q[1] - P[1]) * pow(Q[0] - P[0], _p - 2, _p) % _p
+	x = (l * l - P[0] - Q[0]) % _p
+	return (x, (l * (P[0] - x) - P[1]) % _p)
+
+def ref_multiply(k, P):
+	result = None
+	while k:
+		if k & 1:
+			result = ref_add(result, P)
+		P = ref_add(P, P)
+		k >>= 1
+	return result
+
+G = (_Gx, _Gy)
+
+def scalars():
+	rnd = random.Random(1)
+	return [1, 2, 3, 15, 16, 255, 256, 1 << 128, (1 << 255) + 1, _r - 1, _r - 2] + \
+		[rnd.randrange(1, _r) for i in range(5)]
+
+class TemporaryCacheDir(object):
+	# keeps the generator table cache out of the user's cache directory
+
+	def setUp(self):
+		self.cache_dir = tempfile.mkdtemp(prefix='convertphrase-test-')
+		self.saved_cache_dir = os.environ.get('CONVERTPHRASE_CACHE_DIR')
+		os.environ['CONVERTPHRASE_CACHE_DIR'] = self.cache_dir
+		convertphrase._generator_cache = None
+
+	def tearDown(self):
+		if self.saved_cache_dir is None:
+			del os.environ['CONVERTPHRASE_CACHE_DIR']
+		else:
+			os.environ['CONVERTPHRASE_CACHE_DIR'] = self.saved_cache_dir
+		convertphrase._generator_cache = None
+		shutil.rmtree(self.cache_dir)
+
+class PublicKeyValidationTest(TemporaryCacheDir, unittest.TestCase):
+
+	def test_rejects_off_curve_point(self):
+		bogus = Point(curve_secp256k1, 1, 2, validate=False)
+		self.assertRaises(RuntimeError, Public_key, generator_secp256k1, bogus, True)
+		self.assertRaises(RuntimeError, EC_KEY, 5, True, bogus)
+
+	def test_rejects_infinity(self):
+		self.assertRaises(RuntimeError, Public_key, generator_secp256k1, convertphrase.INFINITY, True)
+
+	def test_accepts_valid_point(self):
+		point = EC_KEY(12345).pubkey.point
+		Public_key(generator_secp256k1, point, True)
+		EC_KEY(12345, True, point)
+
+	def test_unvalidated_point_is_trusted(self):
+		bogus = Point(curve_secp256k1, 1, 2, validate=False)
+		Public_key(generator_secp256k1, bogus, False)
+
+class KnownAnswerTest(TemporaryCacheDir, unittest.TestCase):
+
+	def test_brainwallet(self):
+		sec = convertphrase.SecretToASecret(hashlib.sha256("correct horse battery staple").digest())
+		self.assertEqual(sec, '5KJvsngHeMpm884wtkJNzQGaCErckhHJBGFsvd3VyK5qMZXj3hS')
+		key = convertphrase.regenerate_key(sec)
+		self.assertEqual(convertphrase.public_key_to_bc_address(convertphrase.GetPubKey(key)),
+			'1JwSSubhmg6iPtRjtyqhUYYH7bZg3Lfy1T')
+		self.assertEqual(convertphrase.GetSecret(key), hashlib.sha256("correct horse battery staple").digest())
+
+class MultiplyTest(TemporaryCacheDir, unittest.TestCase):
+
+	def affine(self, P):
+		return convertphrase._jacobian_to_affine(P, _p)
+
+	def test_generator_glv(self):
+		for k in scalars():
+			self.assertEqual(self.affine(convertphrase._generator_multiply_glv(k)), ref_multiply(k, G))
+
+	def test_generator_table(self):
+		# no cache directory, and past the threshold: the 4-bit in-memory table
+		os.environ['CONVERTPHRASE_CACHE_DIR'] = ''
+		saved = convertphrase._generator_multiplications
+		convertphrase._generator_multiplications = convertphrase._G_TABLE_THRESHOLD
+		try:
+			for k in scalars():
+				self.assertEqual(self.affine(convertphrase._generator_multiply(k)), ref_multiply(k, G))
+			self.assertFalse(convertphrase._generator_cache)
+		finally:
+			convertphrase._generator_multiplications = saved
+
+	def test_mapped_generator_table(self):
+		table = convertphrase._cached_generator_table()
+		self.assertTrue(table)
+		for k in scalars():
+			self.assertEqual(self.affine(table.multiply(k)), ref_multiply(k, G))
+			point = generator_secp256k1 * k
+			self.assertEqual((point.x(), point.y()), ref_multiply(k, G))
+
+	def test_point(self):
+		P = ref_multiply(0xdeadbeef, G)
+		point = Point(curve_secp256k1, P[0], P[1])
+		for k in scalars():
+			Q = point * k
+			self.assertEqual((Q.x(), Q.y()), ref_multiply(k, P))
+		self.assertEqual(point * _r, convertphrase.INFINITY)
+
+	def test_derive_keys(self):
+		secrets = scalars()
+		for (k, key) in zip(secrets, convertphrase.derive_keys(secrets)):
+			self.assertEqual((key.pubkey.point.x(), key.pubkey.point.y()), ref_multiply(k, G))
+
+class SignatureTest(TemporaryCacheDir, unittest.TestCase):
+
+	def setUp(self):
+		TemporaryCacheDir.setUp(self)
+		self.keys = [EC_KEY(k) for k in (12345, _r - 7, 1 << 200)]
+		self.hash = 0x5ac1e0ff5ac1e0ff5ac1e0ff5ac1e0ff5ac1e0ff5ac1e0ff5ac1e0ff5ac1e0ff
+
+	def test_sign(self):
+		for key in self.keys:
+			k = 0x1234567890abcdef
+			signature = key.privkey.sign(self.hash, k)
+			r = ref_multiply(k, G)[0] % _r
+			self.assertEqual(signature.r, r)
+			self.assertEqual(signature.s, pow(k, _r - 2, _r) * (self.hash + key.secret * r) % _r)
+
+	def test_verify(self):
+		for key in self.keys:
+			signature = key.privkey.sign(self.hash, 0xfedcba9876543210)
+			self.assertTrue(key.pubkey.verifies(self.hash, signature))
+			self.assertFalse(key.pubkey.verifies(self.hash + 1, signature))
+			self.assertFalse(key.pubkey.verifies(self.hash, Signature(signature.r, _r - signature.s + 1)))
+			other = self.keys[(self.keys.index(key) + 1) % len(self.keys)]
+			self.assertFalse(other.pubkey.verifies(self.hash, signature))
+
+	def test_batch_verifies(self):
+		items = []
+		for (i, key) in enumerate(self.keys * 2):
+			items.append((key.pubkey, self.hash + i, key.privkey.sign(self.hash + i, 1000 + i)))
+		self.assertEqual(convertphrase.batch_verifies(items), [])
+		(public_key, hash, signature) = items[1]
+		items[1] = (public_key, hash + 1, signature)
+		items[3] = (items[3][0], items[3][1], Signature(items[3][2].r, 0))
+		items[4] = (self.keys[0].pubkey, items[4][1], items[4][2])
+		self.assertEqual(convertphrase.batch_verifies(items), [1, 3, 4])
+		self.assertEqual(convertphrase.batch_verifies([]), [])
+
+class GeneratorTableFileTest(TemporaryCacheDir, unittest.TestCase):
+
+	def test_rebuilds_damaged_table(self):
+		self.assertTrue(convertphrase._cached_generator_table())
+		path = os.path.join(self.cache_dir, convertphrase._G_CACHE_FILENAME)
+		good = open(path, 'rb').read()
+
+		# negate one point: still on the curve, header untouched
+		offset = convertphrase._G_CACHE_HEADER_SIZE + 64 * 300
+		y = long(good[offset+32:offset+64].encode('hex'), 16)
+		damaged = good[:offset+32] + ('%064x' % (_p - y)).decode('hex') + good[offset+64:]
+		self.assertTrue(convertphrase.curve_secp256k1.contains_point(
+			long(good[offset:offset+32].encode('hex'), 16), _p - y))
+		open(path, 'wb').write(damaged)
+		self.assertEqual(convertphrase._GeneratorTableFile.open(path), None)
+
+		convertphrase._generator_cache = None
+		table = convertphrase._cached_generator_table()
+		self.assertTrue(table)
+		self.assertEqual(open(path, 'rb').read(), good)
+		self.assertEqual(table.point(300), ref_multiply(46 << 8, G))
+
+	def test_uncacheable(self):
+		os.environ['CONVERTPHRASE_CACHE_DIR'] = ''
+		self.assertFalse(convertphrase._cached_generator_table())
+		point = generator_secp256k1 * 12345
+		self.assertEqual((point.x(), point.y()), ref_multiply(12345, G))
+
+if __name__ == '__main__':
+	unittest.main()
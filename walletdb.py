@@ -0,0 +1,1098 @@
+# wallet.dat support for convertphrase.py: the Berkeley DB environment, the
+# record parser and writer, and the in-memory Wallet model. convertphrase.main()
+# imports it only for the wallet options.
+
+try:
+	from bsddb.db import *
+except ImportError:
+	# without bsddb, wallets can still be read through open_wallet_file
+	class DBNotFoundError(Exception): pass
+import os, sys, time
+import errno
+import json
+import mmap
+import logging
+import struct
+import socket
+import traceback
+
+from convertphrase import hash_160, hash_160_to_bc_address, public_key_to_bc_address, \
+	PrivKeyToSecret, SecretToASecret, regenerate_key, regenerate_keys, \
+	GetPubKey, GetPrivKey, GetSecret
+
+# parser
+
+def create_env(db_dir):
+	db_env = DBEnv(0)
+	r = db_env.open(db_dir, (DB_CREATE|DB_INIT_LOCK|DB_INIT_LOG|DB_INIT_MPOOL|DB_INIT_TXN|DB_THREAD|DB_RECOVER))
+	return db_env
+
+def parse_CAddress(vds):
+	d = {'ip':'0.0.0.0','port':0,'nTime': 0}
+	try:
+		d['nVersion'] = vds.read_int32()
+		d['nTime'] = vds.read_uint32()
+		d['nServices'] = vds.read_uint64()
+		d['pchReserved'] = vds.read_bytes(12)
+		d['ip'] = socket.inet_ntoa(vds.read_bytes(4))
+		d['port'] = vds.read_uint16()
+	except:
+		pass
+	return d
+
+def deserialize_CAddress(d):
+	return d['ip']+":"+str(d['port'])
+
+def parse_BlockLocator(vds):
+	d = { 'hashes' : [] }
+	nHashes = vds.read_compact_size()
+	for i in xrange(nHashes):
+		d['hashes'].append(vds.read_bytes(32))
+		return d
+
+def deserialize_BlockLocator(d):
+  result = "Block Locator top: "+d['hashes'][0][::-1].encode('hex_codec')
+  return result
+
+def parse_setting(setting, vds):
+	if setting[0] == "f":	# flag (boolean) settings
+		return str(vds.read_boolean())
+	elif setting[0:4] == "addr": # CAddress
+		d = parse_CAddress(vds)
+		return deserialize_CAddress(d)
+	elif setting == "nTransactionFee":
+		return vds.read_int64()
+	elif setting == "nLimitProcessors":
+		return vds.read_int32()
+	return 'unknown setting'
+
+class SerializationError(Exception):
+	""" Thrown when there's a problem deserializing or serializing """
+
+_uint8 = struct.Struct('<B')
+_int16 = struct.Struct('<h')
+_uint16 = struct.Struct('<H')
+_int32 = struct.Struct('<i')
+_uint32 = struct.Struct('<I')
+_int64 = struct.Struct('<q')
+_uint64 = struct.Struct('<Q')
+
+class BCDataStream(object):
+	def __init__(self):
+		self.input = None
+		self.read_cursor = 0
+
+	def clear(self):
+		self.input = None
+		self.read_cursor = 0
+
+	def write(self, bytes):	# Initialize with string of bytes
+		if self.input is None:
+			# read-only input is kept as given (str, buffer or mmap), not copied
+			self.input = bytes
+		else:
+			if not isinstance(self.input, bytearray):
+				self.input = bytearray(self.input)
+			self.input += bytes
+
+	def getvalue(self):
+		if self.input is None:
+			return ''
+		return str(self.input)
+
+	def map_file(self, file, start):	# Initialize with bytes from file
+		self.input = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		self.read_cursor = start
+	def seek_file(self, position):
+		self.read_cursor = position
+	def close_file(self):
+		self.input.close()
+
+	def read_string(self):
+		# Strings are encoded depending on length:
+		# 0 to 252 :	1-byte-length followed by bytes (if any)
+		# 253 to 65,535 : byte'253' 2-byte-length followed by bytes
+		# 65,536 to 4,294,967,295 : byte '254' 4-byte-length followed by bytes
+		# ... and the Bitcoin client is coded to understand:
+		# greater than 4,294,967,295 : byte '255' 8-byte-length followed by bytes of string
+		# ... but I don't think it actually handles any strings that big.
+		if self.input is None:
+			raise SerializationError("call write(bytes) before trying to deserialize")
+
+		try:
+			length = self.read_compact_size()
+		except IndexError:
+			raise SerializationError("attempt to read past end of buffer")
+
+		return self.read_bytes(length)
+
+	def write_string(self, string):
+		# Length-encoded as with read-string
+		self.write_compact_size(len(string))
+		self.write(string)
+
+	def read_bytes(self, length):
+		end = self.read_cursor + length
+		if end > len(self.input):
+			raise SerializationError("attempt to read past end of buffer")
+		result = self.input[self.read_cursor:end]
+		self.read_cursor = end
+		return str(result)
+
+	def read_boolean(self): return self._read_num(_uint8) != 0
+	def read_int16(self): return self._read_num(_int16)
+	def read_uint16(self): return self._read_num(_uint16)
+	def read_int32(self): return self._read_num(_int32)
+	def read_uint32(self): return self._read_num(_uint32)
+	def read_int64(self): return self._read_num(_int64)
+	def read_uint64(self): return self._read_num(_uint64)
+
+	def write_boolean(self, val): return self.write(chr(1) if val else chr(0))
+	def write_int16(self, val): return self._write_num(_int16, val)
+	def write_uint16(self, val): return self._write_num(_uint16, val)
+	def write_int32(self, val): return self._write_num(_int32, val)
+	def write_uint32(self, val): return self._write_num(_uint32, val)
+	def write_int64(self, val): return self._write_num(_int64, val)
+	def write_uint64(self, val): return self._write_num(_uint64, val)
+
+	def read_compact_size(self):
+		size = self._read_num(_uint8)
+		if size == 253:
+			size = self._read_num(_uint16)
+		elif size == 254:
+			size = self._read_num(_uint32)
+		elif size == 255:
+			size = self._read_num(_uint64)
+		return size
+
+	def write_compact_size(self, size):
+		if size < 0:
+			raise SerializationError("attempt to write size < 0")
+		elif size < 253:
+			 self.write(chr(size))
+		elif size < 2**16:
+			self.write('\xfd')
+			self._write_num(_uint16, size)
+		elif size < 2**32:
+			self.write('\xfe')
+			self._write_num(_uint32, size)
+		elif size < 2**64:
+			self.write('\xff')
+			self._write_num(_uint64, size)
+
+	def _read_num(self, format):
+		# format is one of the precompiled struct.Struct objects above
+		try:
+			(i,) = format.unpack_from(self.input, self.read_cursor)
+		except struct.error:
+			raise SerializationError("attempt to read past end of buffer")
+		self.read_cursor += format.size
+		return i
+
+	def _write_num(self, format, num):
+		self.write(format.pack(num))
+
+def open_wallet(db_env, writable=False):
+	db = DB(db_env)
+	# a writable wallet is opened transactionally so puts can be grouped in
+	# explicit transactions (see importprivkeys)
+	flags = DB_THREAD | (DB_CREATE | DB_AUTO_COMMIT if writable else DB_RDONLY)
+	try:
+		r = db.open("wallet.dat", "main", DB_BTREE, flags)
+	except DBError:
+		r = True
+
+	if r is not None:
+		logging.error("Couldn't open wallet.dat/main. Try quitting Bitcoin and running this again.")
+		sys.exit(1)
+	
+	return db
+
+# Read-only access to wallet.dat without Berkeley DB: the file is memory-mapped
+# and its B-tree pages are walked directly. Only the on-disk format of btree
+# databases (version 8 and later, unencrypted, without page checksums) is
+# understood.
+
+_BTREE_MAGIC = 0x053162
+_P_IBTREE = 3		# internal page
+_P_LBTREE = 5		# leaf page
+_P_OVERFLOW = 7
+_P_BTREEMETA = 9
+_B_KEYDATA = 1
+_B_OVERFLOW = 3
+_B_DELETE = 0x80
+_PAGE_HEADER_SIZE = 26
+
+class BTreeFile(object):
+	"""A Berkeley DB btree file opened read-only through mmap, with the part
+	of the bsddb DB interface the wallet code uses: cursor() (first, next,
+	set_range, close), get(), items() and close(). subdb names a
+	subdatabase, e.g. "main" in wallet.dat. No environment is opened and no
+	locks are taken.
+	"""
+	def __init__(self, filename, subdb=None):
+		self.file = open(filename, 'rb')
+		try:
+			self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		except (ValueError, mmap.error):
+			self.file.close()
+			raise SerializationError("%s is not a Berkeley DB btree file" % filename)
+
+		for byteorder in ('<', '>'):
+			if struct.unpack_from(byteorder + 'I', self.map, 12)[0] == _BTREE_MAGIC:
+				break
+		else:
+			self.close()
+			raise SerializationError("%s is not a Berkeley DB btree file" % filename)
+		self._u16 = struct.Struct(byteorder + 'H')
+		self._u32 = struct.Struct(byteorder + 'I')
+		# page header: entries, hf_offset, level, type at offset 20
+		self._page_header = struct.Struct(byteorder + 'HHBB')
+
+		(version, self.pagesize, encrypt_alg, type, metaflags) = \
+			struct.unpack_from(byteorder + 'IIBBB', self.map, 16)
+		if version < 8 or type != _P_BTREEMETA or encrypt_alg or (metaflags & 1):
+			self.close()
+			raise SerializationError("unsupported btree file %s" % filename)
+
+		self.root = self._meta_root(0)
+		if subdb is not None:
+			# the master database maps subdatabase names to the page number of
+			# their meta page, stored big-endian
+			meta = self.get(subdb)
+			if meta is None or len(meta) != 4:
+				self.close()
+				raise SerializationError("no database %s in %s" % (subdb, filename))
+			self.root = self._meta_root(struct.unpack('>I', meta)[0])
+
+	def _meta_root(self, pgno):
+		return self._u32.unpack_from(self.map, pgno * self.pagesize + 88)[0]
+
+	def _header(self, pgno):
+		return self._page_header.unpack_from(self.map, pgno * self.pagesize + 20)
+
+	def _next_page(self, pgno):
+		return self._u32.unpack_from(self.map, pgno * self.pagesize + 16)[0]
+
+	def _item_offset(self, pgno, index):
+		base = pgno * self.pagesize
+		return base + self._u16.unpack_from(self.map, base + _PAGE_HEADER_SIZE + 2 * index)[0]
+
+	def _overflow(self, pgno, length):
+		chunks = []
+		while pgno != 0 and length > 0:
+			(entries, hf_offset, level, type) = self._header(pgno)
+			if type != _P_OVERFLOW:
+				raise SerializationError("bad overflow page %d" % pgno)
+			start = pgno * self.pagesize + _PAGE_HEADER_SIZE
+			chunks.append(self.map[start:start + min(hf_offset, length)])
+			length -= hf_offset
+			pgno = self._next_page(pgno)
+		return ''.join(chunks)
+
+	def _leaf_item(self, pgno, index):
+		# (bytes, deleted) of a BKEYDATA or BOVERFLOW item on a leaf page
+		offset = self._item_offset(pgno, index)
+		type = ord(self.map[offset + 2])
+		if (type & 0x7f) == _B_KEYDATA:
+			length = self._u16.unpack_from(self.map, offset)[0]
+			return (self.map[offset + 3:offset + 3 + length], type & _B_DELETE)
+		if (type & 0x7f) == _B_OVERFLOW:
+			return (self._overflow(self._u32.unpack_from(self.map, offset + 4)[0],
+				self._u32.unpack_from(self.map, offset + 8)[0]), type & _B_DELETE)
+		raise SerializationError("unsupported item type %d on page %d" % (type, pgno))
+
+	def _internal_item(self, pgno, index):
+		# (key, child page) of a BINTERNAL item
+		offset = self._item_offset(pgno, index)
+		length = self._u16.unpack_from(self.map, offset)[0]
+		type = ord(self.map[offset + 2]) & 0x7f
+		child = self._u32.unpack_from(self.map, offset + 4)[0]
+		if type == _B_OVERFLOW:
+			key = self._overflow(self._u32.unpack_from(self.map, offset + 16)[0],
+				self._u32.unpack_from(self.map, offset + 20)[0])
+		else:
+			key = self.map[offset + 12:offset + 12 + length]
+		return (key, child)
+
+	def _find_leaf(self, key):
+		# the leaf page where key belongs (the leftmost one for key None)
+		pgno = self.root
+		while True:
+			(entries, hf_offset, level, type) = self._header(pgno)
+			if type == _P_LBTREE:
+				return pgno
+			if type != _P_IBTREE:
+				raise SerializationError("unexpected page type %d on page %d" % (type, pgno))
+			lo, hi = 0, entries - 1
+			if key is not None:
+				# the last child whose separator is <= key; the first separator
+				# is ignored (it stands for minus infinity)
+				while lo < hi:
+					mid = (lo + hi + 1) / 2
+					if self._internal_item(pgno, mid)[0] <= key:
+						lo = mid
+					else:
+						hi = mid - 1
+			pgno = self._internal_item(pgno, lo)[1]
+
+	def cursor(self, txn=None, flags=0):
+		return BTreeCursor(self)
+
+	def get(self, key, default=None, txn=None, flags=0):
+		cursor = self.cursor()
+		rec = cursor.set_range(key)
+		cursor.close()
+		if rec is not None and rec[0] == key:
+			return rec[1]
+		return default
+
+	def items(self):
+		return list(iter_db(self))
+
+	def close(self):
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+		self.file.close()
+
+class BTreeCursor(object):
+	"""Cursor over a BTreeFile, returning (key, value) pairs in key order and
+	None past the end.
+	"""
+	def __init__(self, btree):
+		self.btree = btree
+		self.pgno = None
+		self.index = 0
+
+	def _current(self):
+		# move forward to the first live pair at or after the position
+		btree = self.btree
+		while self.pgno:
+			entries = btree._header(self.pgno)[0]
+			while self.index < entries:
+				(key, deleted) = btree._leaf_item(self.pgno, self.index)
+				if not deleted:
+					return (key, btree._leaf_item(self.pgno, self.index + 1)[0])
+				self.index += 2
+			self.pgno = btree._next_page(self.pgno)
+			self.index = 0
+		self.pgno = None
+		return None
+
+	def first(self):
+		self.pgno = self.btree._find_leaf(None)
+		self.index = 0
+		return self._current()
+
+	def next(self):
+		if self.pgno is None:
+			return self.first()
+		self.index += 2
+		return self._current()
+
+	def set_range(self, key):
+		btree = self.btree
+		self.pgno = btree._find_leaf(key)
+		lo, hi = 0, btree._header(self.pgno)[0] / 2
+		while lo < hi:
+			mid = (lo + hi) / 2
+			if btree._leaf_item(self.pgno, 2 * mid)[0] < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		self.index = 2 * lo
+		return self._current()
+
+	def close(self):
+		self.btree = None
+
+def open_wallet_file(db_dir):
+	"""wallet.dat in db_dir as a read-only BTreeFile, usable wherever the
+	wallet code takes an open wallet database.
+	"""
+	return BTreeFile(os.path.join(db_dir, "wallet.dat"), "main")
+
+# Field layouts of the wallet record types, shared by WalletRecord (reading)
+# and encode_wallet_record (writing): (key fields, value fields), each a
+# sequence of (name, codec) in serialization order. The key fields follow the
+# type string. A value layout of None means the value is not described here.
+
+WALLET_RECORD_FIELDS = {
+	'tx': ((('tx_id', 'hash'),), None),
+	'name': ((('hash', 'string'),), (('name', 'string'),)),
+	'version': ((), (('version', 'uint32'),)),
+	'setting': ((('setting', 'string'),), (('value', 'setting'),)),
+	'key': ((('public_key', 'string'),), (('private_key', 'string'),)),
+	'wkey': ((('public_key', 'string'),), (('private_key', 'string'), ('created', 'int64'),
+		('expires', 'int64'), ('comment', 'string'))),
+	'defaultkey': ((), (('key', 'string'),)),
+	'pool': ((('n', 'int64'),), (('nVersion', 'int32'), ('nTime', 'int64'), ('public_key', 'string'))),
+	'acc': ((('account', 'string'),), (('nVersion', 'int32'), ('public_key', 'string'))),
+	'acentry': ((('account', 'string'), ('n', 'uint64')), (('nVersion', 'int32'), ('nCreditDebit', 'int64'),
+		('nTime', 'int64'), ('otherAccount', 'string'), ('comment', 'string'))),
+	'bestblock': ((), (('nVersion', 'int32'), ('hashes', 'locator'))),
+}
+
+# readers get the stream and the record being decoded (settings depend on
+# the setting name read from the key)
+_FIELD_READERS = {
+	'string': lambda ds, d: ds.read_string(),
+	'hash': lambda ds, d: ds.read_bytes(32),
+	'int32': lambda ds, d: ds.read_int32(),
+	'uint32': lambda ds, d: ds.read_uint32(),
+	'int64': lambda ds, d: ds.read_int64(),
+	'uint64': lambda ds, d: ds.read_uint64(),
+	'setting': lambda ds, d: parse_setting(d['setting'], ds),
+	'locator': lambda ds, d: parse_BlockLocator(ds)['hashes'],
+}
+
+_FIELD_WRITERS = {
+	'string': BCDataStream.write_string,
+	'hash': BCDataStream.write,
+	'int32': BCDataStream.write_int32,
+	'uint32': BCDataStream.write_uint32,
+	'int64': BCDataStream.write_int64,
+	'uint64': BCDataStream.write_uint64,
+}
+
+# field name -> 0 (key) or 1 (value), per type
+_FIELD_SIDES = dict((type, dict((name, side)
+		for side in (0, 1) for (name, codec) in (layout[side] or ())))
+	for (type, layout) in WALLET_RECORD_FIELDS.items())
+
+class WalletRecord(object):
+	"""One wallet.dat record. Only its type is decoded up front: the key and
+	the value fields are each decoded on first access. Items are read like
+	the data dictionaries of parse_wallet, including the raw "__key__",
+	"__value__" and "__type__".
+	"""
+	__slots__ = ('type', 'key', 'value', '_key_offset', '_fields', '_decoded')
+
+	def __init__(self, key, value, type, key_offset):
+		self.type = type
+		self.key = key
+		self.value = value
+		self._key_offset = key_offset	# where the key fields start, after the type
+		self._fields = None
+		self._decoded = [False, False]
+
+	def _decode(self, side):
+		self._decoded[side] = True
+		if self._fields is None:
+			self._fields = {}
+		layout = WALLET_RECORD_FIELDS.get(self.type)
+		if layout is None or layout[side] is None:
+			return
+		ds = BCDataStream()
+		if side == 0:
+			ds.write(self.key)
+			ds.read_cursor = self._key_offset
+		else:
+			ds.write(self.value)
+		for (name, codec) in layout[side]:
+			self._fields[name] = _FIELD_READERS[codec](ds, self)
+
+	def __getitem__(self, name):
+		if name == "__key__": return self.key
+		if name == "__value__": return self.value
+		if name == "__type__": return self.type
+		if self._fields is not None and name in self._fields:
+			return self._fields[name]
+		side = _FIELD_SIDES.get(self.type, {}).get(name)
+		if side is None or self._decoded[side]:
+			raise KeyError(name)
+		self._decode(side)
+		return self._fields[name]
+
+	def __setitem__(self, name, value):
+		for side in (0, 1):
+			if not self._decoded[side]: self._decode(side)
+		self._fields[name] = value
+
+	def get(self, name, default=None):
+		try:
+			return self[name]
+		except KeyError:
+			return default
+
+	def __contains__(self, name):
+		return name in self.keys()
+
+	has_key = __contains__
+
+	def keys(self):
+		for side in (0, 1):
+			if not self._decoded[side]: self._decode(side)
+		return ["__key__", "__value__", "__type__"] + self._fields.keys()
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def items(self):
+		return [(name, self[name]) for name in self.keys()]
+
+	def __repr__(self):
+		return "WalletRecord(%r)" % dict(self.items())
+
+def wallet_record(key, value):
+	"""The WalletRecord of a raw key/value pair; only the type is decoded."""
+	kds = BCDataStream()
+	kds.write(key)
+	type = kds.read_string()
+	return WalletRecord(key, value, type, kds.read_cursor)
+
+def iter_db(db):
+	"""Yield the (key, value) pairs of db in B-tree order through a cursor,
+	one at a time.
+	"""
+	cursor = db.cursor()
+	try:
+		rec = cursor.first()
+		while rec is not None:
+			yield rec
+			rec = cursor.next()
+	finally:
+		cursor.close()
+
+def iter_db_prefix(db, prefix):
+	"""Yield the (key, value) pairs of db whose key starts with prefix. The
+	cursor seeks straight to the first such key and stops after the last one.
+	"""
+	cursor = db.cursor()
+	try:
+		try:
+			rec = cursor.set_range(prefix)
+		except DBNotFoundError:
+			rec = None
+		while rec is not None and rec[0].startswith(prefix):
+			yield rec
+			rec = cursor.next()
+	finally:
+		cursor.close()
+
+def wallet_type_prefix(type):
+	"""Every wallet record key starts with its serialized type string, so all
+	records of one type are contiguous in the B-tree under this prefix.
+	"""
+	kds = BCDataStream()
+	kds.write_string(type)
+	return kds.getvalue()
+
+def iter_wallet_db(db, types=None):
+	"""The raw (key, value) pairs of wallet.dat, all of them or only those of
+	the given types (one range scan per type, still in B-tree order).
+	"""
+	if types is None:
+		return iter_db(db)
+	prefixes = sorted(set(wallet_type_prefix(type) for type in types))
+	return (rec for prefix in prefixes for rec in iter_db_prefix(db, prefix))
+
+def _wallet_parse_error(type, key, value):
+	# to stderr, so that it does not end up in a JSON dump or export
+	traceback.print_exc()
+	sys.stderr.write("ERROR parsing wallet.dat, type %s\n" % type)
+	sys.stderr.write("key data in hex: %s\n" % key.encode('hex_codec'))
+	sys.stderr.write("value data in hex: %s\n" % value.encode('hex_codec'))
+	sys.exit(1)
+
+def iter_wallet(db, types=None):
+	"""Yield the records of wallet.dat one at a time, in B-tree order, as
+	WalletRecord objects (used like the data dictionaries parse_wallet gives
+	to item_callback). If types is given, only the key ranges of those types
+	are scanned.
+	"""
+	for (key, value) in iter_wallet_db(db, types):
+		d = wallet_record(key, value)
+		if types is not None and d.type not in types:
+			continue
+
+		yield d
+
+def parse_wallet(db, item_callback, types=None):
+	for d in iter_wallet(db, types):
+		try:
+			item_callback(d["__type__"], d)
+		except Exception, e:
+			_wallet_parse_error(d["__type__"], d["__key__"], d["__value__"])
+	
+def encode_wallet_record(type, data):
+	"""The (key, value) strings of a record, from its type and the fields
+	listed for it in WALLET_RECORD_FIELDS.
+	"""
+	if type not in WALLET_RECORD_FIELDS:
+		raise SerializationError("Unknown key type: %s" % type)
+	key_fields, value_fields = WALLET_RECORD_FIELDS[type]
+	if value_fields is None:
+		raise NotImplementedError("Writing items of type '%s'" % type)
+
+	kds = BCDataStream()
+	vds = BCDataStream()
+
+	# Write the type code to the key
+	kds.write_string(type)
+	for (ds, fields) in ((kds, key_fields), (vds, value_fields)):
+		for (name, codec) in fields:
+			if codec not in _FIELD_WRITERS:
+				raise NotImplementedError("Writing items of type '%s'" % type)
+			_FIELD_WRITERS[codec](ds, data[name])
+
+	return (kds.getvalue(), vds.getvalue())
+
+def update_wallet(db, type, data, txn=None):
+	"""Write a single item to the wallet.
+	db must be open with writable=True.
+	type and data are the type code and data dictionary as parse_wallet would
+	give to item_callback.
+	data's __key__, __value__ and __type__ are ignored; only the primary data
+	fields are used.
+	txn is an optional transaction to write in.
+	"""
+	try:
+		(key, value) = encode_wallet_record(type, data)
+
+		# Write the key/value pair to the database
+		db.put(key, value, txn=txn)
+
+	except Exception, e:
+		print("ERROR writing to wallet.dat, type %s"%type)
+		print("data dictionary: %r"%data)
+		traceback.print_exc()
+
+# the records a key export needs: the keys and the address labels
+KEY_EXPORT_TYPES = ('key', 'name')
+
+def rewrite_wallet(db_env, destFileName, pre_put_callback=None, commit_size=1000,
+		progress_callback=None, progress_interval=10000):
+	"""Copy wallet.dat into destFileName, keeping the records for which
+	pre_put_callback(type, d) is true (all of them without a callback).
+	Records are copied as raw key/value pairs in cursor order, which is the
+	B-tree's sorted order, so the new tree is filled sequentially. A record
+	is only decoded as far as the callback reads it: d is a WalletRecord.
+	Puts are grouped into transactions of commit_size.
+	progress_callback(read, written, seconds) is called every
+	progress_interval records and once at the end, e.g. with
+	print_rewrite_progress. Returns the final (read, written, seconds).
+	A record that cannot be decoded, or that makes the callback fail, is
+	reported like parse_wallet errors.
+	"""
+	if commit_size < 1 or progress_interval < 1:
+		raise ValueError("commit_size and progress_interval must be at least 1")
+	db = open_wallet(db_env)
+
+	db_out = DB(db_env)
+	try:
+		r = db_out.open(destFileName, "main", DB_BTREE, DB_CREATE | DB_AUTO_COMMIT)
+	except DBError:
+		r = True
+
+	if r is not None:
+		logging.error("Couldn't open %s."%destFileName)
+		sys.exit(1)
+
+	start = time.time()
+	read = written = 0
+	txn = None
+	try:
+		for (key, value) in iter_db(db):
+			read += 1
+			if progress_callback is not None and (read % progress_interval) == 0:
+				progress_callback(read, written, time.time() - start)
+			if pre_put_callback is not None:
+				d = None
+				try:
+					d = wallet_record(key, value)
+					keep = pre_put_callback(d.type, d)
+				except Exception, e:
+					_wallet_parse_error(d.type if d is not None else "unknown", key, value)
+				if not keep:
+					continue
+			if txn is None:
+				txn = db_env.txn_begin()
+			db_out.put(key, value, txn=txn)
+			written += 1
+			if written % commit_size == 0:
+				txn.commit()
+				txn = None
+		if txn is not None:
+			txn.commit()
+			txn = None
+	finally:
+		if txn is not None:
+			txn.abort()
+		db_out.close()
+		db.close()
+
+	stats = (read, written, time.time() - start)
+	if progress_callback is not None:
+		progress_callback(*stats)
+	return stats
+
+def print_rewrite_progress(read, written, seconds):
+	sys.stderr.write("%d records read, %d written, %.0f records/s\n" %
+		(read, written, read / seconds if seconds > 0 else 0))
+
+class Wallet(object):
+	"""The contents of a wallet.dat, held in memory with hash indexes so that
+	keys can be looked up by address, public key or hash160 in constant time.
+	Fill it from parse_wallet/iter_wallet records with add(), or use
+	load_wallet().
+	"""
+	def __init__(self):
+		self.keys = []		# {'addr', 'sec', 'public_key', 'hash160'}, in wallet order
+		self.pool = []
+		self.names = {}		# address -> label
+		self.settings = {}
+		self.version = None
+		self.defaultkey = None
+		self.wkeys = []
+		self.accounts = []	# (account, address of its current key)
+		self.acentries = []
+		self.bestblock = None
+		self.unsupported = set()
+
+		self.by_address = {}
+		self.by_public_key = {}
+		self.by_hash160 = {}
+
+	def add(self, type, d, derived=None):
+		"""Add one record. derived is what derive_record(type, d) returns, if
+		the caller already computed it (load_wallet does, in worker processes).
+		"""
+		if derived is None:
+			derived = derive_record(type, d)
+
+		if type == "name":
+			self.names[d['hash']] = d['name']
+
+		elif type == "version":
+			self.version = d['version']
+
+		elif type == "setting":
+			self.settings[d['setting']] = d['value']
+
+		elif type == "defaultkey":
+			self.defaultkey = derived[1]
+
+		elif type == "key":
+			(h160, addr, sec) = derived
+			self.add_key(d['public_key'], None, h160, addr, sec)
+
+		elif type == "wkey":
+			self.wkeys.append({'addr' : derived[1], 'created' : d['created']})
+
+		elif type == "pool":
+			self.pool.append({'n': d['n'], 'addr': derived[1], 'nTime' : d['nTime']})
+
+		elif type == "acc":
+			self.accounts.append((d['account'], derived[1]))
+
+		elif type == "acentry":
+			self.acentries.append((d['account'], d['nCreditDebit'], d['otherAccount'], time.ctime(d['nTime']), d['n'], d['comment']))
+
+		elif type == "bestblock":
+			self.bestblock = d['hashes'][0][::-1].encode('hex_codec')
+
+		else:
+			self.unsupported.add(type)
+
+	def add_key(self, public_key, secret, h160=None, addr=None, sec=None):
+		"""Index a key; h160, addr and sec are derived from public_key and
+		secret unless the caller already has them.
+		"""
+		if h160 is None:
+			h160 = hash_160(public_key)
+		if addr is None:
+			addr = hash_160_to_bc_address(h160)
+		if sec is None:
+			sec = SecretToASecret(secret)
+		k = {'addr' : addr, 'sec' : sec, 'public_key' : public_key, 'hash160' : h160}
+		self.keys.append(k)
+		self.by_address[addr] = k
+		self.by_public_key[public_key] = k
+		self.by_hash160[h160] = k
+		return k
+
+	def key_by_address(self, addr):
+		return self.by_address.get(addr)
+
+	def key_by_public_key(self, public_key):
+		return self.by_public_key.get(public_key)
+
+	def key_by_hash160(self, h160):
+		return self.by_hash160.get(h160)
+
+	def label(self, addr):
+		return self.names.get(addr)
+
+	def json_db(self):
+		"""The wallet as the json_db dictionary read_wallet has always built."""
+		json_db = {}
+		json_db['keys'] = []
+		for k in self.keys:
+			entry = {'addr' : k['addr'], 'sec' : k['sec']}
+			if k['addr'] in self.names:
+				entry["label"] = _export_text(self.names[k['addr']])
+			else:
+				entry["reserve"] = 1
+			json_db['keys'].append(entry)
+		if self.version is not None: json_db['version'] = self.version
+		if self.settings: json_db['settings'] = dict((name, _export_text(value) if isinstance(value, str) else value)
+			for (name, value) in self.settings.items())
+		if self.defaultkey is not None: json_db['defaultkey'] = self.defaultkey
+		if self.wkeys: json_db['wkey'] = [{'created' : w['created']} for w in self.wkeys]
+		if self.accounts: json_db['acc'] = _export_text(self.accounts[-1][0])
+		if self.acentries: json_db['acentry'] = [_export_text(value) if isinstance(value, str) else value
+			for value in self.acentries[-1]]
+		if self.bestblock is not None: json_db['bestblock'] = self.bestblock
+		for type in self.unsupported:
+			json_db[type] = 'unsupported'
+		return json_db
+
+def derive_record(type, d):
+	"""The hashing and encoding a record needs: (hash160, address, WIF
+	secret) for the public key it holds, the secret only for "key" records.
+	None for records without a key.
+	"""
+	sec = None
+	if type == "key":
+		public_key = d['public_key']
+		sec = SecretToASecret(PrivKeyToSecret(d['private_key']))
+	elif type in ("wkey", "pool", "acc"):
+		public_key = d['public_key']
+	elif type == "defaultkey":
+		public_key = d['key']
+	else:
+		return None
+	h160 = hash_160(public_key)
+	return (h160, hash_160_to_bc_address(h160), sec)
+
+def _derive_chunk(chunk):
+	# runs in a load_wallet worker process
+	result = []
+	for (key, value) in chunk:
+		d = wallet_record(key, value)
+		result.append(derive_record(d.type, d))
+	return result
+
+def _iter_chunks(iterable, chunk_size):
+	chunk = []
+	for item in iterable:
+		chunk.append(item)
+		if len(chunk) == chunk_size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+def load_wallet(db_env, types=None, workers=1, chunk_size=1000, db=None):
+	"""Read wallet.dat into a new Wallet. types restricts the scan to the
+	record types wanted, e.g. KEY_EXPORT_TYPES when only keys are needed.
+	With workers > 1, the records are read in chunks of chunk_size and the
+	hashing and Base58 encoding of their keys (derive_record) runs in a pool
+	of that many processes; the results are added back in wallet order, with
+	at most two chunks per worker in flight.
+	db is an already open wallet database (e.g. from open_wallet_file) to read
+	instead of opening wallet.dat in db_env; it is left open.
+	"""
+	if workers > 1 and chunk_size < 1:
+		raise ValueError("chunk_size must be at least 1")
+	if db is None:
+		db = open_wallet(db_env)
+		close_db = db.close
+	else:
+		close_db = lambda: None
+	wallet = Wallet()
+	if workers <= 1:
+		parse_wallet(db, wallet.add, types)
+		close_db()
+		return wallet
+
+	import collections
+	import multiprocessing
+	pool = multiprocessing.Pool(workers)
+	try:
+		pending = collections.deque()
+		def add_chunk(chunk, result):
+			for ((key, value), derived) in zip(chunk, result.get()):
+				d = wallet_record(key, value)
+				try:
+					wallet.add(d.type, d, derived)
+				except Exception, e:
+					_wallet_parse_error(d.type, key, value)
+
+		for chunk in _iter_chunks(iter_wallet_db(db, types), chunk_size):
+			pending.append((chunk, pool.apply_async(_derive_chunk, (chunk,))))
+			if len(pending) >= 2 * workers:
+				add_chunk(*pending.popleft())
+		while pending:
+			add_chunk(*pending.popleft())
+	finally:
+		pool.terminate()
+		pool.join()
+	close_db()
+	return wallet
+
+def read_wallet(json_db, db_env, print_wallet, print_wallet_transactions, transaction_filter, types=None,
+		workers=1, chunk_size=1000, db=None):
+	"""Fill json_db from wallet.dat and return the loaded Wallet. See
+	load_wallet for types, workers, chunk_size and db.
+	"""
+	wallet = load_wallet(db_env, types, workers, chunk_size, db)
+
+	# on stderr, so that stdout is left to the JSON dump
+	for (account, addr) in wallet.accounts:
+		sys.stderr.write("Account %s (current key: %s)\n" % (account, addr))
+
+	json_db.update(wallet.json_db())
+	return wallet
+
+def _label_key(addr):
+	kds = BCDataStream()
+	kds.write_string('name')
+	kds.write_string(addr)
+	return kds.getvalue()
+
+def label_of(db, addr):
+	"""The label of addr, looked up directly in the B-tree; None if it has
+	no name record.
+	"""
+	value = db.get(_label_key(addr))
+	if value is None:
+		return None
+	vds = BCDataStream()
+	vds.write(value)
+	return vds.read_string()
+
+def export_record(db, d):
+	"""The export object of one record: its fields, with public keys
+	replaced by their addresses, the WIF secret of keys and their label
+	(read from db) or reserve flag, as in read_wallet's keys list.
+	"""
+	type = d.type
+	derived = derive_record(type, d)
+	e = {'type': type}
+	if type == "key":
+		e['addr'] = derived[1]
+		e['sec'] = derived[2]
+		label = label_of(db, derived[1])
+		if label is not None:
+			e['label'] = label
+		else:
+			e['reserve'] = 1
+	elif type == "wkey":
+		e.update(addr=derived[1], created=d['created'], expires=d['expires'], comment=d['comment'])
+	elif type == "pool":
+		e.update(n=d['n'], addr=derived[1], nTime=d['nTime'])
+	elif type == "acc":
+		e.update(account=d['account'], addr=derived[1])
+	elif type == "defaultkey":
+		e['addr'] = derived[1]
+	elif type == "name":
+		e.update(addr=d['hash'], label=d['name'])
+	elif type == "version":
+		e['version'] = d['version']
+	elif type == "setting":
+		e.update(setting=d['setting'], value=d['value'])
+	elif type == "acentry":
+		e.update(account=d['account'], n=d['n'], nCreditDebit=d['nCreditDebit'], nTime=d['nTime'],
+			otherAccount=d['otherAccount'], comment=d['comment'])
+	elif type == "bestblock":
+		e['hash'] = d['hashes'][0][::-1].encode('hex_codec')
+	elif type == "tx":
+		e['tx_id'] = d['tx_id'][::-1].encode('hex_codec')
+	else:
+		e['unsupported'] = 1
+	for (name, value) in e.items():
+		if isinstance(value, str):
+			e[name] = _export_text(value)
+	return e
+
+def _export_text(s):
+	# labels, accounts and comments are normally UTF-8; anything else is read
+	# as latin-1, which keeps every byte, rather than failing the export
+	try:
+		return s.decode('utf-8')
+	except UnicodeDecodeError:
+		return s.decode('latin-1')
+
+def export_wallet(db, out, types=None):
+	"""Write the records of wallet.dat to the file out as newline-delimited
+	JSON, one export_record object per line, in B-tree order. Each line is
+	written and flushed as soon as its record is read, so a reader on a pipe
+	sees the records while the scan runs, and nothing is kept in memory.
+	types restricts the scan as for iter_wallet. If the reader closes the
+	pipe, the export stops there. Returns the number of records written.
+	"""
+	count = 0
+	for d in iter_wallet(db, types):
+		try:
+			line = json.dumps(export_record(db, d), sort_keys=True)
+		except Exception, e:
+			_wallet_parse_error(d.type, d.key, d.value)
+		try:
+			out.write(line + "\n")
+			out.flush()
+		except IOError, e:
+			if e.errno != errno.EPIPE:
+				raise
+			break
+		count += 1
+	return count
+
+def importprivkey(db, sec):
+	pkey = regenerate_key(sec)
+	if not pkey:
+		return False
+
+	secret = GetSecret(pkey)
+	private_key = GetPrivKey(pkey)
+	public_key = GetPubKey(pkey)
+	addr = public_key_to_bc_address(public_key)
+
+	print "Address: %s" % addr
+	print "Privkey: %s" % SecretToASecret(secret)
+
+	update_wallet(db, 'key', { 'public_key' : public_key, 'private_key' : private_key })
+	update_wallet(db, 'name', { 'hash' : addr, 'name' : '' })
+
+	return True
+
+def importprivkeys(db_env, db, secs, commit_size=1000, txn_flags=0):
+	"""Import many WIF secrets at once.
+	The keys are derived as one batch (regenerate_keys), and their key and
+	name records are sorted into B-tree key order and written in transactions
+	of commit_size puts. txn_flags sets the durability of those transactions,
+	e.g. DB_TXN_NOSYNC; the last one is always committed synchronously, which
+	also flushes the log of the earlier ones.
+	db must be open with writable=True.
+	Returns the address of each imported key, or False for each secret that
+	could not be decoded, in the order of secs.
+	"""
+	if commit_size < 1:
+		raise ValueError("commit_size must be at least 1")
+	addrs = []
+	records = []
+	for pkey in regenerate_keys(secs):
+		if not pkey:
+			addrs.append(False)
+			continue
+		public_key = GetPubKey(pkey)
+		addr = public_key_to_bc_address(public_key)
+		addrs.append(addr)
+		records.append(encode_wallet_record('key', { 'public_key' : public_key, 'private_key' : GetPrivKey(pkey) }))
+		records.append(encode_wallet_record('name', { 'hash' : addr, 'name' : '' }))
+
+	records.sort()
+	for i in xrange(0, len(records), commit_size):
+		last = i + commit_size >= len(records)
+		txn = db_env.txn_begin(None, 0 if last else txn_flags)
+		try:
+			for (key, value) in records[i:i+commit_size]:
+				db.put(key, value, txn=txn)
+		except:
+			txn.abort()
+			raise
+		txn.commit()
+
+	return addrs